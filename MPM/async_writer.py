@@ -0,0 +1,56 @@
+import queue
+import threading
+
+
+# writes frames on a background thread while the simulation keeps running.
+# A fixed pool of host buffers is shared with the writer: acquire() blocks
+# until the writer has released a buffer, which throttles the simulation
+# when the disk falls behind. flush() waits until every submitted frame is
+# on disk, e.g. before a checkpoint refers to them. close() writes every
+# queued frame before it returns, so call it from a finally block to flush
+# on exit or Ctrl-C.
+class AsyncFrameWriter:
+
+    def __init__(self, make_buffer, n_buffers=2):
+        self.free_buffers = queue.Queue()
+        for _ in range(n_buffers):
+            self.free_buffers.put(make_buffer())
+        self.pending = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        self.check_error()
+        return self.free_buffers.get()
+
+    def submit(self, write_fn, buffer):
+        self.pending.put((write_fn, buffer))
+
+    def worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            write_fn, buffer = item
+            try:
+                if self.error is None:
+                    write_fn(buffer)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free_buffers.put(buffer)
+                self.pending.task_done()
+
+    def check_error(self):
+        if self.error is not None:
+            raise Exception("frame writer failed") from self.error
+
+    def flush(self):
+        self.pending.join()
+        self.check_error()
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.check_error()
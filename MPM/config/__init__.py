@@ -2,5 +2,19 @@ from .water_yelly_snow_cfg import WaterYellySnowCfg
 from .different_density_cfg import DifferentDensityCfg
 from .flood_cfg import FloodCfg
 from .two_fluid import TwoFluidCfg
-from .two_balls import TwoBallCfg
-from .ply_example_cfg import PlyExampleCfg
\ No newline at end of file
+from .two_balls import TwoBallCfg, TwoBallEnsembleCfg
+from .ply_example_cfg import PlyExampleCfg
+from .flood_2d_cfg import Flood2DCfg
+from .fountain_cfg import FountainCfg
+
+scenarios = {
+    "WaterYellySnow": WaterYellySnowCfg,
+    "DifferentDensity": DifferentDensityCfg,
+    "Flood": FloodCfg,
+    "TwoFluid": TwoFluidCfg,
+    "TwoBalls": TwoBallCfg,
+    "TwoBallsEnsemble": TwoBallEnsembleCfg,
+    "PlyExample": PlyExampleCfg,
+    "Flood2D": Flood2DCfg,
+    "Fountain": FountainCfg,
+}
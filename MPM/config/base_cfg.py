@@ -1,8 +1,158 @@
+import copy
+
+
 class BaseCfg:
+    # 2 or 3. A 2D scene gives box_size, object positions, sizes and
+    # velocities with 2 components, and particles_per_unit_volume is then
+    # per unit area
     dim = 3
     quality = 2
     dt = 2e-4 / quality
     box_size = [1.0, 1.0, 1.0]
-    base_max_num_particles = 2**20
+    # None sizes the particle fields from the scene's own particle count,
+    # otherwise base_max_num_particles * quality**dim slots are allocated
+    base_max_num_particles = None
     base_n_grid_per_length = 32
     particles_per_unit_volume = 2**19
+    # share of the particles that is actually sampled, for cubes and balls
+    # as well as for the points of .ply objects
+    particle_fraction = 1.0
+    # placement of the particles of cubes and balls: "random" samples them
+    # uniformly, "jittered" places one particle at a random position in every
+    # cell of a grid with particles_per_unit_volume cells per unit volume.
+    # The jittered grid leaves no holes at lower particle counts and is
+    # reproducible, the same seed gives the same initial state
+    sampling = "random"
+    seed = 0
+    # PlyGeometry inputs are cached here: .ply point clouds as float32
+    # arrays that are memory-mapped on later launches, and the samples of
+    # meshes (mesh_path), keyed by the mesh, resize_coef, density and seed
+    cache_dir = "data/cache"
+    # save the initial particle state in cache_dir and load it on later runs
+    # of the same scene, see SimulationRunner.init_state_key
+    init_cache = False
+    # keep compiled kernels in cache_dir/kernels between runs, see
+    # init_taichi in MPM/simulation_runner.py
+    kernel_cache = True
+    # B-spline of the particle-grid transfers: "quadratic" (3 nodes per axis)
+    # or "linear" (2 nodes per axis, cheaper but more dissipative)
+    transfer_kernel = "quadratic"
+    # preview tier for blocking out scenes, see preview_cfg
+    preview = False
+    preview_coarsening = 2
+    # allocate the background grid in blocks that are activated by P2G
+    # instead of densely over the whole box_size
+    sparse_grid = False
+    grid_block_size = 8
+    substeps_per_frame = 100
+    # substeps advanced by one fused kernel launch. The substep body is
+    # unrolled that many times, so compile time grows quickly beyond 2-4
+    substeps_per_launch = 1
+    # adaptive time stepping: every substep takes dt = cfl * dx / max speed,
+    # where the speed includes the elastic wave speed, capped by max_dt
+    # (None: one frame). Frames still span dt * substeps_per_frame
+    adaptive_dt = False
+    cfl = 0.5
+    max_dt = None
+    # sort the particle arrays by grid cell (Morton order) every N frames to
+    # improve cache locality in P2G and G2P, 0 disables reordering
+    reorder_interval = 0
+    # "atomic": every particle scatters straight into the global grid.
+    # "binned": particles are binned by grid block and scatter into
+    # block-local scratch memory first (implies the sparse grid layout)
+    p2g_engine = "atomic"
+    max_particles_per_cell = 64
+    # particles whose speed and velocity gradient stay below sleep_velocity
+    # and sleep_strain_rate for sleep_substeps substeps fall asleep: they are
+    # skipped by P2G and G2P, and the grid nodes around them become static.
+    # Awake particles arriving there faster than wake_velocity wake them
+    sleep = False
+    sleep_velocity = 1e-2
+    sleep_strain_rate = 1e-1
+    sleep_substeps = 100
+    wake_velocity = 1e-1
+    # SinkGeometry boxes that retire every particle entering them. Retired
+    # slots are reused by EmitterGeometry objects; every compact_interval
+    # frames (0: never) the particles are compacted so that the used slots
+    # of every material are contiguous again
+    sinks = []
+    compact_interval = 0
+    # independent copies of the scene that are simulated side by side along
+    # x in one runner, e.g. for parameter sweeps. Every member is a dict of
+    # object overrides: string keys apply to all objects, integer keys map
+    # an object index to overrides for that object only. Only p_rho, E, nu,
+    # init_vel and color can be overridden. See ensemble_cfg
+    ensemble = []
+    # empty grid nodes between neighboring members, which keeps their
+    # particle-grid transfers apart
+    ensemble_gap = 4
+    # memory layout of the per-particle state: "soa" (one array per field),
+    # "aos" (one struct per particle) or "hybrid" (x, v, C in one struct,
+    # F, Jp, material and object in another)
+    particle_layout = "soa"
+    # storage precision of the particle state. "f32" stores everything in
+    # the default float type, "f16" stores v and C as half floats (24 bytes
+    # less per particle in 3D) while all arithmetic stays in f32,
+    # "f64" runs the whole simulation in double precision for validation
+    precision = "f32"
+
+
+def preview_cfg(cfg):
+    # the preview tier of a scene: linear transfers on a grid that is
+    # preview_coarsening times coarser per axis. The particles are thinned
+    # by the same factor per axis, so every cell keeps its particle count.
+    # dt is kept, the linear stencil is not stable at the dt a quadratic
+    # one would allow on the coarser grid
+    c = cfg.preview_coarsening
+    return type(
+        cfg.__name__ + "Preview", (cfg, ), {
+            "preview": False,
+            "transfer_kernel": "linear",
+            "base_n_grid_per_length": cfg.base_n_grid_per_length // c,
+            "particle_fraction": cfg.particle_fraction / c**cfg.dim,
+        })
+
+
+ENSEMBLE_OVERRIDES = ("p_rho", "E", "nu", "init_vel", "color")
+
+
+def ensemble_pitch(cfg):
+    # distance between the origins of neighboring members, a whole number
+    # of grid cells
+    n_grid_per_length = cfg.base_n_grid_per_length * cfg.quality
+    return (round(cfg.box_size[0] * n_grid_per_length) +
+            cfg.ensemble_gap) / n_grid_per_length
+
+
+def ensemble_cfg(cfg):
+    # the scene of an ensemble: member k is a copy of the objects and sinks
+    # with its overrides, moved by k pitches along x. Objects stay grouped
+    # by member, member k owns objects [k * n, (k + 1) * n)
+    pitch = ensemble_pitch(cfg)
+    objects, sinks = [], []
+    for k, member in enumerate(cfg.ensemble):
+        offset = [k * pitch] + [0.0] * (cfg.dim - 1)
+        for j, obj in enumerate(cfg.objects):
+            overrides = {
+                key: value
+                for key, value in member.items() if isinstance(key, str)
+            }
+            overrides.update(member.get(j, {}))
+            obj = copy.deepcopy(obj)
+            for key, value in overrides.items():
+                if key not in ENSEMBLE_OVERRIDES:
+                    raise Exception(f"Ensemble members cannot override {key}")
+                setattr(obj, key, value)
+            obj.translate(offset)
+            objects.append(obj)
+        for sink in cfg.sinks:
+            sink = copy.deepcopy(sink)
+            sink.translate(offset)
+            sinks.append(sink)
+    return type(
+        cfg.__name__ + "Ensemble", (cfg, ), {
+            "ensemble": [],
+            "box_size": [len(cfg.ensemble) * pitch, *cfg.box_size[1:]],
+            "objects": objects,
+            "sinks": sinks,
+        })
@@ -0,0 +1,42 @@
+import taichi as ti
+from MPM.geometry import CubeGeometry, BallGeometry
+from MPM.config.base_cfg import BaseCfg
+from MPM import WATER, JELLY, SNOW
+
+
+# 2D preview of the Flood scene layout
+class Flood2DCfg(BaseCfg):
+    dim = 2
+    box_size = [2.0, 2.0]
+    # particles per unit area, about 8 per grid cell at quality 1
+    particles_per_unit_volume = 2**13
+
+    objects = [
+        CubeGeometry(
+            material=WATER,
+            minimum=ti.Vector([0.05, 0.01]),
+            size=ti.Vector([0.3, 1.5]),
+            p_rho=1.0,
+            E=0.1e4,
+            nu=0.2,
+            init_vel=[0.0, 0.0],
+        ),
+        CubeGeometry(
+            material=JELLY,
+            minimum=ti.Vector([1.0, 0.01]),
+            size=ti.Vector([0.2, 0.2]),
+            p_rho=1.0,
+            E=0.1e4,
+            nu=0.2,
+            init_vel=[0.0, 0.0],
+        ),
+        BallGeometry(
+            material=SNOW,
+            center=ti.Vector([1.5, 0.5]),
+            radius=0.15,
+            p_rho=1.0,
+            E=0.1e4,
+            nu=0.2,
+            init_vel=[0.0, 0.0],
+        ),
+    ]
@@ -0,0 +1,39 @@
+import taichi as ti
+from MPM.geometry import CubeGeometry, EmitterGeometry, SinkGeometry
+from MPM.config.base_cfg import BaseCfg
+from MPM import WATER, JELLY, SNOW
+
+
+class FountainCfg(BaseCfg):
+    box_size = [2.0, 1.0, 1.0]
+    compact_interval = 50
+
+    objects = [
+        # a water jet from the left wall onto a jelly block, drained by a
+        # sink along the floor on the right
+        EmitterGeometry(
+            material=WATER,
+            minimum=ti.Vector([0.1, 0.6, 0.4]),
+            size=ti.Vector([0.05, 0.1, 0.1]),
+            flow_rate=0.02,
+            max_particles=60000,
+            p_rho=1.0,
+            E=0.1e4,
+            nu=0.2,
+            init_vel=[2.0, 0.0, 0.0],
+        ),
+        CubeGeometry(
+            material=JELLY,
+            minimum=ti.Vector([0.8, 0.01, 0.4]),
+            size=ti.Vector([0.2, 0.2, 0.2]),
+            p_rho=2.0,
+            E=0.1e4,
+            nu=0.2,
+        ),
+    ]
+    sinks = [
+        SinkGeometry(
+            minimum=ti.Vector([1.6, 0.0, 0.0]),
+            size=ti.Vector([0.4, 0.15, 1.0]),
+        ),
+    ]
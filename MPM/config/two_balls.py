@@ -28,3 +28,11 @@ class TwoBallCfg(BaseCfg):
             init_vel=[-2.0, 0.0, 0.0]
         ),
     ]
+
+
+class TwoBallEnsembleCfg(TwoBallCfg):
+    # TwoBalls with three values of the left ball's Young's modulus, run
+    # side by side in one simulation. Jittered sampling gives every member
+    # the same initial particles
+    ensemble = [{0: {"E": 1e3}}, {0: {"E": 3e3}}, {0: {"E": 1e4}}]
+    sampling = "jittered"
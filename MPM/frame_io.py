@@ -0,0 +1,114 @@
+import numpy as np
+
+# binary frame file written by SimulationRunner with --output_format=binary.
+# little endian, every section starts at a multiple of 8 bytes:
+#   header:        magic, version, flags, dim, n_objects, n_particles
+#   object ranges: int64 [n_objects, 2], [start, end) of every object in
+#                  cfg.objects order, indexing the particle arrays below
+#   positions:     float32 [n_particles, dim]
+#   velocities:    float32 [n_particles, dim]  (only with FLAG_VELOCITY)
+#   materials:     int32 [n_particles]         (only with FLAG_MATERIAL)
+# all sections can be memory-mapped, see read_frame. Version 1 files only
+# padded the end of the materials section, so in 3D frames with an odd
+# particle count the sections after the positions were not aligned.
+FRAME_FILE_NAME = "particles.mpmf"
+MAGIC = b"MPMFRAME"
+VERSION = 2
+FLAG_VELOCITY = 1
+FLAG_MATERIAL = 2
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("flags", "<u4"),
+    ("dim", "<u4"),
+    ("padding", "<u4"),
+    ("n_objects", "<u8"),
+    ("n_particles", "<u8"),
+])
+
+
+def write_frame(path, object_ranges, x, v=None, materials=None):
+    flags = 0
+    if v is not None:
+        flags |= FLAG_VELOCITY
+    if materials is not None:
+        flags |= FLAG_MATERIAL
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["flags"] = flags
+    header["dim"] = x.shape[1]
+    header["n_objects"] = len(object_ranges)
+    header["n_particles"] = x.shape[0]
+
+    with open(path, "wb") as f:
+        header.tofile(f)
+        np.asarray(object_ranges, dtype="<i8").reshape(-1, 2).tofile(f)
+        np.ascontiguousarray(x, dtype="<f4").tofile(f)
+        write_padding(f)
+        if v is not None:
+            np.ascontiguousarray(v, dtype="<f4").tofile(f)
+            write_padding(f)
+        if materials is not None:
+            np.ascontiguousarray(materials, dtype="<i4").tofile(f)
+            write_padding(f)
+
+
+def write_padding(f):
+    # zeros up to the next multiple of 8 bytes
+    f.write(bytes(-f.tell() % 8))
+
+
+def section_end(offset, version):
+    # the next section starts at a multiple of 8 bytes, see VERSION
+    return offset + -offset % 8 if version > 1 else offset
+
+
+def read_frame(path):
+    # returns read-only memory maps of the frame sections, nothing is loaded
+    # until it is accessed
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise Exception(f"{path} is not an MPM frame file")
+    if header["version"] not in (1, VERSION):
+        raise Exception(
+            f"unsupported frame file version {header['version']} in {path}")
+
+    version = int(header["version"])
+    dim, flags = int(header["dim"]), int(header["flags"])
+    n_objects, n_particles = int(header["n_objects"]), int(
+        header["n_particles"])
+    offset = HEADER_DTYPE.itemsize
+
+    frame = {}
+    frame["object_ranges"] = np.memmap(path,
+                                       dtype="<i8",
+                                       mode="r",
+                                       offset=offset,
+                                       shape=(n_objects, 2))
+    offset += n_objects * 2 * 8
+    frame["x"] = np.memmap(path,
+                           dtype="<f4",
+                           mode="r",
+                           offset=offset,
+                           shape=(n_particles, dim))
+    offset = section_end(offset + n_particles * dim * 4, version)
+    if flags & FLAG_VELOCITY:
+        frame["v"] = np.memmap(path,
+                               dtype="<f4",
+                               mode="r",
+                               offset=offset,
+                               shape=(n_particles, dim))
+        offset = section_end(offset + n_particles * dim * 4, version)
+    if flags & FLAG_MATERIAL:
+        frame["materials"] = np.memmap(path,
+                                       dtype="<i4",
+                                       mode="r",
+                                       offset=offset,
+                                       shape=(n_particles, ))
+    return frame
+
+
+def object_positions(frame, j):
+    start, end = frame["object_ranges"][j]
+    return frame["x"][start:end]
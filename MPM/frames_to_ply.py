@@ -0,0 +1,54 @@
+import os
+import argparse
+import numpy as np
+import taichi as ti
+from tqdm import tqdm
+from MPM.frame_io import FRAME_FILE_NAME, read_frame, object_positions
+
+# converts the binary frames written with --output_format=binary into the
+# per-object .ply files that MPM/reconstruction.py expects. The .ply files
+# are written next to the binary frame, i.e. <input_dir>/<frame>/. The
+# members of an ensemble run are converted one after the other from their
+# <input_dir>/member_<k>/ directories.
+#
+# usage: python -m MPM.frames_to_ply --input_dir output/Flood
+
+
+def convert_frame(frame_dir, binary):
+    frame = read_frame(os.path.join(frame_dir, FRAME_FILE_NAME))
+    for j in range(frame["object_ranges"].shape[0]):
+        x = object_positions(frame, j)
+        writer = ti.tools.PLYWriter(num_vertices=x.shape[0])
+        # 2D frames are written in the z = 0 plane
+        z = x[:, 2] if x.shape[1] == 3 else np.zeros(x.shape[0])
+        writer.add_vertex_pos(x[:, 0], x[:, 1], z)
+        if binary:
+            writer.export(os.path.join(frame_dir, f"particle_object_{j}.ply"))
+        else:
+            writer.export_ascii(
+                os.path.join(frame_dir, f"particle_object_{j}.ply"))
+
+
+def convert_dir(input_dir, binary):
+    names = os.listdir(input_dir)
+    members = sorted(n for n in names if n.startswith("member_"))
+    for member in members:
+        convert_dir(os.path.join(input_dir, member), binary)
+    frame_list = sorted((n for n in names if n.isdigit()), key=int)
+    if frame_list:
+        for frame in tqdm(frame_list, desc=input_dir):
+            convert_frame(os.path.join(input_dir, frame), binary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir',
+                        type=str,
+                        required=True,
+                        help="simulation output directory")
+    parser.add_argument('--binary',
+                        action='store_true',
+                        help="write binary instead of ascii .ply files")
+
+    args = parser.parse_args()
+    convert_dir(args.input_dir, args.binary)
@@ -1,3 +1,5 @@
 from .ball import BallGeometry
 from .cube import CubeGeometry
-from .ply import PlyGeometry
\ No newline at end of file
+from .ply import PlyGeometry
+from .emitter import EmitterGeometry
+from .sink import SinkGeometry
@@ -1,4 +1,4 @@
-from MPM.geometry.base_geometry import BaseGeometry
+from MPM.geometry.base_geometry import BaseGeometry, jittered_grid
 import numpy as np
 
 
@@ -16,6 +16,21 @@ class BallGeometry(BaseGeometry):
         super().__init__(material, p_rho, E, nu, color, init_vel)
         self.center = center
         self.radius = radius
-        self.volume = 4 / 3 * np.pi * radius**3
+        # a ball with a 2D center is a disk, its volume is the area
+        self.dim = len(center)
+        if self.dim == 2:
+            self.volume = np.pi * radius**2
+        else:
+            self.volume = 4 / 3 * np.pi * radius**3
         self.start_p_idx = None
         self.end_p_idx = None
+
+    def sample(self, spacing, rng):
+        # the jittered grid of the bounding cube, cut to the ball
+        center = np.asarray(self.center, float)
+        points = jittered_grid(center - self.radius,
+                               [2 * self.radius] * self.dim, spacing, rng)
+        return points[np.linalg.norm(points - center, axis=1) <= self.radius]
+
+    def translate(self, offset):
+        self.center = [float(c) + o for c, o in zip(self.center, offset)]
@@ -1,3 +1,5 @@
+import numpy as np
+
 material_colors = [(0.1, 0.6, 0.9), (0.93, 0.33, 0.23), (1.0, 1.0, 1.0)]
 
 
@@ -20,3 +22,13 @@ class BaseGeometry:
             self.init_vel = [0.0, 0.0, 0.0]
         else:
             self.init_vel = init_vel
+
+
+def jittered_grid(minimum, size, spacing, rng):
+    # one point per cell of a grid with cells of roughly spacing, placed
+    # uniformly at random inside its cell
+    minimum, size = np.asarray(minimum, float), np.asarray(size, float)
+    n_cells = np.maximum(np.round(size / spacing), 1).astype(np.int64)
+    cells = np.stack(np.meshgrid(*[np.arange(n) for n in n_cells],
+                                 indexing="ij"), -1).reshape(-1, len(size))
+    return minimum + (cells + rng.random(cells.shape)) * (size / n_cells)
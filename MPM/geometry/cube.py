@@ -1,4 +1,5 @@
-from MPM.geometry.base_geometry import BaseGeometry
+from MPM.geometry.base_geometry import BaseGeometry, jittered_grid
+import numpy as np
 
 
 class CubeGeometry(BaseGeometry):
@@ -15,6 +16,15 @@ class CubeGeometry(BaseGeometry):
         super().__init__(material, p_rho, E, nu, color, init_vel)
         self.minimum = minimum
         self.size = size
-        self.volume = self.size.x * self.size.y * self.size.z
+        # a cube with a 2D minimum and size is a rectangle, its volume is the
+        # area
+        self.dim = len(size)
+        self.volume = float(np.prod(list(size)))
         self.start_p_idx = None
         self.end_p_idx = None
+
+    def sample(self, spacing, rng):
+        return jittered_grid(self.minimum, self.size, spacing, rng)
+
+    def translate(self, offset):
+        self.minimum = [float(c) + o for c, o in zip(self.minimum, offset)]
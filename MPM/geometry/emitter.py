@@ -0,0 +1,34 @@
+from MPM.geometry.base_geometry import BaseGeometry
+import numpy as np
+
+
+class EmitterGeometry(BaseGeometry):
+
+    def __init__(self,
+                 minimum,
+                 size,
+                 material,
+                 flow_rate,
+                 max_particles,
+                 p_rho=1.0,
+                 E=0.1e4,
+                 nu=0.2,
+                 color=None,
+                 init_vel=None):
+        super().__init__(material, p_rho, E, nu, color, init_vel)
+        # box the particles are emitted in, with init_vel. flow_rate is the
+        # emitted volume per second, for a steady jet about the area of the
+        # box facing init_vel times the speed
+        self.minimum = minimum
+        self.size = size
+        self.dim = len(size)
+        self.flow_rate = flow_rate
+        # slots reserved for this emitter, emission pauses while they are all
+        # taken until sinks retire particles again
+        self.max_particles = max_particles
+        self.volume = float(np.prod(list(size)))
+        self.start_p_idx = None
+        self.end_p_idx = None
+
+    def translate(self, offset):
+        self.minimum = [float(c) + o for c, o in zip(self.minimum, offset)]
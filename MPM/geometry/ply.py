@@ -13,11 +13,18 @@ class PlyGeometry(BaseGeometry):
                  init_vel=None,
                  translation=[0.0, 0.0, 0.0],
                  rotation=[0.0, 0.0, 0.0],
-                 resize_coef=1.0):
+                 resize_coef=1.0,
+                 mesh_path=None):
         super().__init__(material, p_rho, E, nu, color, init_vel)
         self.ply_path = ply_path
+        # a closed mesh (e.g. .obj) that is filled with particles at the
+        # density of the simulation instead of loading ply_path
+        self.mesh_path = mesh_path
         self.translation = translation
         self.rotation = rotation
         self.resize_coef = resize_coef
         self.start_p_idx = None
-        self.end_p_idx = None
\ No newline at end of file
+        self.end_p_idx = None
+
+    def translate(self, offset):
+        self.translation = [float(c) + o for c, o in zip(self.translation, offset)]
@@ -0,0 +1,10 @@
+# box that retires every particle entering it
+class SinkGeometry:
+
+    def __init__(self, minimum, size):
+        self.minimum = minimum
+        self.size = size
+        self.dim = len(size)
+
+    def translate(self, offset):
+        self.minimum = [float(c) + o for c, o in zip(self.minimum, offset)]
@@ -0,0 +1,198 @@
+import os
+import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import trimesh
+
+# fills closed meshes with particles at the density the runner simulates
+# them with. The mesh is voxelized on a grid whose cells hold one particle
+# each at the final scale (resize_coef), i.e. particles_per_unit_volume cells
+# per unit volume, and every inside cell gets one particle at a random
+# position within the cell. A cell is inside if an odd number of mesh
+# triangles crosses its z column below the cell center.
+# Samples are cached in cache_dir, keyed by the mesh contents, scale,
+# density and seed. The points are returned in mesh coordinates, the runner
+# applies rotation, resize_coef and translation as for .ply point clouds.
+#
+# usage: python -m MPM.mesh_sampler --input_dir data/obj --output_dir data/ply
+#            --size 0.5 --particles_per_unit_volume 524288
+
+# triangles per vectorized batch, bounds the memory of the triangle/column
+# pairs
+TRIANGLE_BATCH = 65536
+# upper bound of the voxel grid, larger grids are most likely a wrong scale
+MAX_GRID_CELLS = 2**32
+# column centers are moved off the grid lines by a fixed irrational fraction
+# of a cell, so that no column passes exactly through an edge or vertex shared
+# by two triangles of an axis-aligned mesh. Such a column would be crossed
+# twice at the same height and come out empty
+COLUMN_OFFSET = np.array([np.sqrt(2), np.sqrt(3)]) * 1e-4
+
+
+def load_triangles(mesh_path):
+    # only the triangles are needed, textures are not loaded
+    loaded = trimesh.load(mesh_path, skip_materials=True)
+    meshes = (loaded.geometry.values()
+              if isinstance(loaded, trimesh.Scene) else [loaded])
+    return np.concatenate([m.vertices[m.faces] for m in meshes])
+
+
+def sample_mesh(mesh_path,
+                scale,
+                particles_per_unit_volume,
+                seed=0,
+                cache_dir="data/cache"):
+    with open(mesh_path, "rb") as f:
+        mesh_hash = hashlib.sha256(f.read()).hexdigest()
+    key = hashlib.sha256(
+        f"{mesh_hash} {scale!r} {particles_per_unit_volume!r} {seed}".encode(
+        )).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(mesh_path))[0]
+    cache_path = os.path.join(cache_dir, f"{name}_{key}.npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path, mmap_mode="r")
+
+    triangles = load_triangles(mesh_path)
+    spacing = particles_per_unit_volume**(-1 / 3) / scale
+    points = fill_mesh(triangles, spacing, np.random.default_rng(seed))
+
+    # written under a temporary name first, another process may be sampling
+    # the same mesh
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, points)
+    os.replace(tmp_path, cache_path)
+    return points
+
+
+def fill_mesh(triangles, spacing, rng):
+    bounds = triangles.min((0, 1)), triangles.max((0, 1))
+    n_cells = np.maximum(np.ceil((bounds[1] - bounds[0]) / spacing),
+                         1).astype(np.int64)
+    # the grid is centered on the bounding box
+    origin = (bounds[0] + bounds[1]) / 2 - n_cells * spacing / 2
+    if np.prod(n_cells.astype(float)) > MAX_GRID_CELLS:
+        raise Exception(f"voxel grid of {n_cells.tolist()} cells, the scale "
+                        "or density is too large for this mesh")
+    nx, ny, nz = n_cells
+
+    # every triangle crossing column (i, j) between the centers of cells
+    # k - 1 and k is recorded as (i * ny + j, k)
+    columns, ks = [], []
+    for first in range(0, triangles.shape[0], TRIANGLE_BATCH):
+        tri = (triangles[first:first + TRIANGLE_BATCH] - origin) / spacing - 0.5
+        tri[:, :, :2] -= COLUMN_OFFSET
+        # columns whose center lies in the xy bounding box of a triangle
+        lo = np.ceil(tri[:, :, :2].min(1)).astype(np.int64)
+        hi = np.floor(tri[:, :, :2].max(1)).astype(np.int64)
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, [nx - 1, ny - 1])
+        counts = np.maximum(hi - lo + 1, 0)
+        n_pairs = counts[:, 0] * counts[:, 1]
+        t = np.repeat(np.arange(tri.shape[0]), n_pairs)
+        local = np.arange(t.shape[0]) - np.repeat(
+            np.cumsum(n_pairs) - n_pairs, n_pairs)
+        i = lo[t, 0] + local // counts[t, 1]
+        j = lo[t, 1] + local % counts[t, 1]
+
+        # barycentric coordinates of the column centers in the xy projection
+        a, b, c = tri[t, 0], tri[t, 1], tri[t, 2]
+        ab, ac = b - a, c - a
+        px, py = i - a[:, 0], j - a[:, 1]
+        det = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = (px * ac[:, 1] - py * ac[:, 0]) / det
+            v = (ab[:, 0] * py - ab[:, 1] * px) / det
+            hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1)
+        z = a[hit, 2] + u[hit] * ab[hit, 2] + v[hit] * ac[hit, 2]
+        columns.append(i[hit] * ny + j[hit])
+        ks.append(np.clip(np.floor(z).astype(np.int64) + 1, 0, nz))
+    columns, ks = np.concatenate(columns), np.concatenate(ks)
+
+    # sorted along every column, crossings 2n and 2n + 1 bound a run of
+    # inside cells. The last crossing of a column with an odd count (an
+    # open mesh) is dropped
+    order = np.lexsort((ks, columns))
+    columns, ks = columns[order], ks[order]
+    _, column_start, column_count = np.unique(columns,
+                                              return_index=True,
+                                              return_counts=True)
+    rank = np.arange(columns.shape[0]) - np.repeat(column_start,
+                                                   column_count)
+    begin = np.nonzero((rank % 2 == 0) &
+                       (rank + 1 < np.repeat(column_count, column_count)))[0]
+    run_length = ks[begin + 1] - ks[begin]
+    run = np.repeat(np.arange(begin.shape[0]), run_length)
+    column = columns[begin][run]
+    k = ks[begin][run] + np.arange(run.shape[0]) - np.repeat(
+        np.cumsum(run_length) - run_length, run_length)
+    cells = np.stack([column // ny, column % ny, k], 1)
+    return (origin + (cells + rng.random(cells.shape)) * spacing).astype(
+        np.float32)
+
+
+def convert_mesh(mesh_path, output_dir, scale, size,
+                 particles_per_unit_volume, seed, cache_dir):
+    import taichi as ti
+
+    if size is not None:
+        triangles = load_triangles(mesh_path)
+        scale = size / np.ptp(triangles.reshape(-1, 3), 0).max()
+    points = sample_mesh(mesh_path, scale, particles_per_unit_volume, seed,
+                         cache_dir)
+    name = os.path.splitext(os.path.basename(mesh_path))[0]
+    writer = ti.tools.PLYWriter(num_vertices=points.shape[0])
+    writer.add_vertex_pos(points[:, 0], points[:, 1], points[:, 2])
+    writer.export(os.path.join(output_dir, f"{name}.ply"))
+    return name, points.shape[0], scale
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir',
+                        type=str,
+                        default="data/obj",
+                        help="directory of the .obj meshes")
+    parser.add_argument('--output_dir',
+                        type=str,
+                        default="data/ply",
+                        help="directory of the sampled .ply point clouds")
+    parser.add_argument('--scale',
+                        type=float,
+                        default=1.0,
+                        help="resize_coef the point clouds are used with")
+    parser.add_argument('--size',
+                        type=float,
+                        default=None,
+                        help="scale every mesh to this longest bounding box "
+                        "edge instead of using --scale")
+    parser.add_argument('--particles_per_unit_volume',
+                        type=float,
+                        default=2**19,
+                        help="particle density at the final scale")
+    parser.add_argument('--seed', type=int, default=0, help="jitter seed")
+    parser.add_argument('--cache_dir',
+                        type=str,
+                        default="data/cache",
+                        help="directory of the cached samples")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help="worker processes (default: one per CPU)")
+
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    mesh_list = sorted(f for f in os.listdir(args.input_dir)
+                       if f.endswith(".obj"))
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(convert_mesh, os.path.join(args.input_dir, f),
+                        args.output_dir, args.scale, args.size,
+                        args.particles_per_unit_volume, args.seed,
+                        args.cache_dir) for f in mesh_list
+        ]
+        for future in futures:
+            name, n_points, scale = future.result()
+            print(f"Sampled {n_points} points inside the {name} mesh "
+                  f"(resize_coef={scale:.6g}).")
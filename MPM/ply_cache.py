@@ -0,0 +1,29 @@
+import os
+import hashlib
+import numpy as np
+
+# .ply point clouds are converted once into float32 .npy files in cache_dir
+# and memory-mapped from there on, so later launches neither parse the .ply
+# nor import open3d. The cache key is the path, size and modification time
+# of the .ply file, which avoids reading the whole file to hash it.
+
+
+def load_ply_points(ply_path, cache_dir="data/cache"):
+    stat = os.stat(ply_path)
+    key = hashlib.sha256(
+        f"{os.path.realpath(ply_path)} {stat.st_size} {stat.st_mtime_ns}".
+        encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(ply_path))[0]
+    cache_path = os.path.join(cache_dir, f"{name}_{key}.npy")
+    if not os.path.exists(cache_path):
+        # open3d is slow to import and only needed to parse the .ply
+        import open3d as o3d
+
+        print(f'converting {ply_path} to {cache_path}')
+        pcd = o3d.io.read_point_cloud(ply_path)
+        points = np.asarray(pcd.points, dtype=np.float32)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, points)
+        os.replace(tmp_path, cache_path)
+    return np.load(cache_path, mmap_mode="r")
@@ -0,0 +1,119 @@
+import json
+import time
+from contextlib import contextmanager
+
+import taichi as ti
+
+
+# wall-clock timer for the phases of a substep. Every phase is synchronized
+# with the device before and after it runs, so the measured time belongs to
+# that phase only. When disabled, phase() adds no synchronization at all.
+class PhaseProfiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.frames = []
+        self.phase_time = {}
+        self.n_substeps = 0
+        self.n_particle_updates = 0
+        self.n_grid_cell_updates = 0
+        # stage times of StartupTimer, reported with the phases
+        self.startup = {}
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        ti.sync()
+        start = time.perf_counter()
+        yield
+        ti.sync()
+        self.phase_time[name] = (self.phase_time.get(name, 0.0) +
+                                 time.perf_counter() - start)
+
+    def count_substep(self, n_particles, n_grid_cells):
+        self.n_substeps += 1
+        self.n_particle_updates += n_particles
+        self.n_grid_cell_updates += n_grid_cells
+
+    def end_frame(self):
+        particle_time = (self.phase_time.get("p2g", 0.0) +
+                         self.phase_time.get("g2p", 0.0))
+        grid_time = (self.phase_time.get("clear_grid", 0.0) +
+                     self.phase_time.get("grid_op", 0.0))
+        frame = {
+            "frame": len(self.frames),
+            "substeps": self.n_substeps,
+            "phase_time": self.phase_time,
+            "total_time": sum(self.phase_time.values()),
+            "particles_per_sec": (self.n_particle_updates / particle_time
+                                  if particle_time > 0 else 0.0),
+            "grid_cells_per_sec": (self.n_grid_cell_updates / grid_time
+                                   if grid_time > 0 else 0.0),
+        }
+        self.frames.append(frame)
+        self.phase_time = {}
+        self.n_substeps = 0
+        self.n_particle_updates = 0
+        self.n_grid_cell_updates = 0
+        return frame
+
+    def summary(self):
+        phase_time = {}
+        for frame in self.frames:
+            for name, t in frame["phase_time"].items():
+                phase_time[name] = phase_time.get(name, 0.0) + t
+        n_frames = max(len(self.frames), 1)
+        return {
+            "startup": self.startup,
+            "n_frames": len(self.frames),
+            "phase_time": phase_time,
+            "mean_phase_time_per_frame":
+            {name: t / n_frames
+             for name, t in phase_time.items()},
+            "mean_particles_per_sec":
+            sum(f["particles_per_sec"] for f in self.frames) / n_frames,
+            "mean_grid_cells_per_sec":
+            sum(f["grid_cells_per_sec"] for f in self.frames) / n_frames,
+            "frames": self.frames,
+        }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# wall-clock time of the startup stages of a run (imports, ti.init, object
+# loading, field allocation, object init, first frame). Stages are laps
+# between consecutive calls, so they add up to the total startup time.
+class StartupTimer:
+
+    def __init__(self, start=None):
+        self.last = time.perf_counter() if start is None else start
+        self.stages = {}
+
+    def lap(self, name, sync=True):
+        # ti.sync is only valid after ti.init
+        if sync:
+            ti.sync()
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def split(self, name, steady_time, part):
+        # moves the time of stage name above steady_time into stage part,
+        # e.g. the JIT compilation out of the first frame
+        self.stages[part] = max(self.stages[name] - steady_time, 0.0)
+        self.stages[name] -= self.stages[part]
+
+    def elapsed(self):
+        ti.sync()
+        return time.perf_counter() - self.last
+
+    def report(self):
+        total = sum(self.stages.values())
+        lines = [f"startup {total:.3f}s:"]
+        for name, t in self.stages.items():
+            lines.append(f"  {name:<18}{t:8.3f}s")
+        return "\n".join(lines)
@@ -2,148 +2,480 @@ import numpy as np
 import taichi as ti
 from taichi import math
 import os
-from MPM.geometry import CubeGeometry, BallGeometry, PlyGeometry
+import json
+import hashlib
+import shutil
+from MPM.geometry import (CubeGeometry, BallGeometry, PlyGeometry,
+                          EmitterGeometry)
 from MPM import WATER, JELLY, SNOW
+from MPM.config.base_cfg import preview_cfg, ensemble_cfg, ensemble_pitch
+from MPM.profiler import PhaseProfiler, StartupTimer
+from MPM.frame_io import FRAME_FILE_NAME, write_frame
+from MPM.async_writer import AsyncFrameWriter
+from MPM.ply_cache import load_ply_points
 from tqdm import tqdm
-import open3d as o3d
+
+
+def morton_code(cells):
+    # interleaves the bits of 10-bit cell coordinates
+    code = np.zeros(cells.shape[0], dtype=np.int64)
+    for bit in range(10):
+        for d in range(cells.shape[1]):
+            code |= ((cells[:, d] >> bit) & 1) << (bit * cells.shape[1] + d)
+    return code
+
+
+def as_vec3(v):
+    # kernels take 3 components per vector, 2D vectors are padded with 0
+    v = [float(c) for c in v]
+    return v + [0.0] * (3 - len(v))
+
+
+def init_taichi(cfg, arch=ti.gpu, **kwargs):
+    # ti.init for a scene: the default float type follows cfg.precision and
+    # kernels are cached in cache_dir/kernels if cfg.kernel_cache is set.
+    # Taichi keys the cached kernels by their IR and the compile options, so
+    # kernels of older code versions are never loaded; they are evicted least
+    # recently used first once the cache outgrows its size limit
+    options = {
+        "default_fp": ti.f64 if cfg.precision == "f64" else ti.f32,
+        "offline_cache": cfg.kernel_cache,
+    }
+    options.update(kwargs)
+    if options["offline_cache"]:
+        options.setdefault("offline_cache_file_path",
+                           os.path.join(cfg.cache_dir, "kernels"))
+        options.setdefault("offline_cache_cleaning_policy", "lru")
+    ti.init(arch=arch, **options)
+
 
 @ti.data_oriented
 class SimulationRunner:
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, startup=None):
+        # startup stages are timed from ti.init on unless the caller started
+        # timing earlier
+        self.startup = StartupTimer() if startup is None else startup
+        self.preview = cfg.preview
+        if self.preview:
+            cfg = preview_cfg(cfg)
+        # the members of an ensemble are laid out along x, each in a box of
+        # member_box_size that starts at a multiple of member_pitch
+        self.ensemble_size = max(len(cfg.ensemble), 1)
+        self.member_box_size = cfg.box_size
+        self.member_pitch = ensemble_pitch(cfg)
+        if cfg.ensemble:
+            cfg = ensemble_cfg(cfg)
         self.cfg = cfg
 
         # simulation/discretization constants
         self.dim = self.cfg.dim
+        if self.dim not in (2, 3):
+            raise Exception(f"Unsupported dim {self.dim}")
         self.quality = self.cfg.quality  # Use a larger value for higher-res simulations
-        self.max_n_particles, self.n_grid_per_length = (
-            cfg.base_max_num_particles * self.quality**self.dim,
-            cfg.base_n_grid_per_length * self.quality,
-        )
-        self.particles_per_unit_volume = cfg.particles_per_unit_volume
-        self.dt = self.cfg.dt
+        self.n_grid_per_length = cfg.base_n_grid_per_length * self.quality
+        self.member_pitch_nodes = round(self.member_pitch *
+                                        self.n_grid_per_length)
+        self.particles_per_unit_volume = (cfg.particles_per_unit_volume *
+                                          cfg.particle_fraction)
+        # storage type of v and C, everything is computed in the default
+        # float type, which is f64 only with ti.init(default_fp=ti.f64)
+        if (self.cfg.precision == "f64"
+                and ti.lang.impl.get_runtime().default_fp != ti.f64):
+            raise Exception(
+                "precision 'f64' needs ti.init(default_fp=ti.f64)")
+        self.state_fp = ti.f16 if self.cfg.precision == "f16" else float
+        # dt is a field so that adaptive time stepping can change it between
+        # launches without recompiling the substep kernels
+        self.dt = ti.field(float, shape=())
+        self.dt[None] = self.cfg.dt
+        self.frame_dt = self.cfg.dt * self.cfg.substeps_per_frame
+        self.dt_history = []
         self.dx = 1.0 / self.n_grid_per_length
         self.inv_dx = float(self.n_grid_per_length)
+        if cfg.transfer_kernel not in ("quadratic", "linear"):
+            raise Exception(
+                f"Undefined transfer kernel {cfg.transfer_kernel}")
+        # the stencil starts at the node below x for the linear B-spline and
+        # half a cell lower for the quadratic one
+        self.stencil_shift = 0.0 if cfg.transfer_kernel == "linear" else 0.5
+        # grid nodes per axis around a particle: 3 for the quadratic
+        # B-spline, 2 for the linear one
+        self.stencil_size = 2 if cfg.transfer_kernel == "linear" else 3
 
         # physics related constants
         self.gravity = -9.8
 
+        # particle fields are sized from the scene unless a budget is given
+        self.objects = cfg.objects
+        self.trivial_geometry_objects = []
+        # jittered-grid samples of the cubes and balls, None for "random"
+        self.trivial_points = []
+        self.ply_objects = []
+        self.ply_points = []
+        self.emitters = []
+        self.sinks = cfg.sinks
+        self.load_objects()
+        # the initial particle state of a scene is cached under a hash of
+        # everything it depends on, a cached scene skips loading and
+        # sampling its objects as well as the init kernels
+        self.init_cache_path = None
+        if cfg.init_cache:
+            self.init_cache_path = os.path.join(
+                cfg.cache_dir, f"init_{self.init_state_key()}.npz")
+        init_cached = (self.init_cache_path is not None
+                       and os.path.exists(self.init_cache_path))
+        if init_cached:
+            with np.load(self.init_cache_path) as state:
+                self.n_scene_particles = int(state["n_scene_particles"])
+        else:
+            self.sample_objects()
+        self.startup.lap("load_objects")
+        # emitters and sinks add and retire particles while the simulation
+        # runs, which leaves unused slots inside the material ranges
+        self.dynamic = len(self.emitters) > 0 or len(self.sinks) > 0
+        if cfg.base_max_num_particles is None:
+            self.max_n_particles = self.n_scene_particles
+        else:
+            self.max_n_particles = (cfg.base_max_num_particles *
+                                    self.quality**self.dim)
+        assert self.n_scene_particles <= self.max_n_particles
+
         # for simulation
         self.p_vol = (self.dx * 0.5)**(self.dim)
-        self.p_rho = ti.field(float, self.max_n_particles)
-        self.p_mass = ti.field(float, self.max_n_particles)
-        self.p_E = ti.field(float, self.max_n_particles)
-        self.p_nu = ti.field(float, self.max_n_particles)
-        self.p_mu_0 = ti.field(float, self.max_n_particles)
-        self.p_lambda_0 = ti.field(float, self.max_n_particles)
-        self.x = ti.Vector.field(self.dim, float, self.max_n_particles)  # position
-        self.v = ti.Vector.field(self.dim, float, self.max_n_particles)  # velocity
-        self.C = ti.Matrix.field(self.dim, self.dim, float,
-                                 self.max_n_particles)  # The APIC-related matrix
-        self.F = ti.Matrix.field(
-            self.dim, self.dim, dtype=float,
-            shape=self.max_n_particles)  # deformation gradient
-        self.Jp = ti.field(float, self.max_n_particles)
-        self.grid_v = ti.Vector.field(
-            self.dim,
-            float,
-            (
-                int(self.n_grid_per_length * self.cfg.box_size[0]),
-                int(self.n_grid_per_length * self.cfg.box_size[1]),
-                int(self.n_grid_per_length * self.cfg.box_size[2]),
-            ),
-        )
-        self.grid_m = ti.field(
-            float,
-            (
-                int(self.n_grid_per_length * self.cfg.box_size[0]),
-                int(self.n_grid_per_length * self.cfg.box_size[1]),
-                int(self.n_grid_per_length * self.cfg.box_size[2]),
-            ),
-        )
-        self.materials = ti.field(int, self.max_n_particles)
+        # material parameters are constant per object, particles only store
+        # the index of their object in cfg.objects
+        n_objects = len(self.objects)
+        self.obj_rho = ti.field(float, n_objects)
+        self.obj_mass = ti.field(float, n_objects)
+        self.obj_mu_0 = ti.field(float, n_objects)
+        self.obj_lambda_0 = ti.field(float, n_objects)
+        self.obj_color = ti.Vector.field(4, float, n_objects)
+        self.p_obj = ti.field(ti.i16)
+        self.x = ti.Vector.field(self.dim, float)  # position
+        self.v = ti.Vector.field(self.dim, self.state_fp)  # velocity
+        self.C = ti.Matrix.field(self.dim, self.dim,
+                                 self.state_fp)  # The APIC-related matrix
+        self.F = ti.Matrix.field(self.dim, self.dim,
+                                 dtype=float)  # deformation gradient
+        self.Jp = ti.field(float)
+        self.materials = ti.field(int)
+        self.place_particle_fields()
+        self.grid_shape = tuple(
+            int(self.n_grid_per_length * self.cfg.box_size[d])
+            for d in range(self.dim))
+        self.grid_v = ti.Vector.field(self.dim, float)
+        self.grid_m = ti.field(float)
+        grid_fields = [self.grid_v, self.grid_m]
+        if self.cfg.sleep:
+            # nodes where awake particles would wake sleeping ones, cleared
+            # with the grid
+            self.grid_disturbed = ti.field(ti.i32)
+            grid_fields.append(self.grid_disturbed)
+        grid_axes = ti.ij if self.dim == 2 else ti.ijk
+        # the binned P2G engine keeps its particle lists in the grid blocks
+        self.sparse_grid = (self.cfg.sparse_grid
+                            or self.cfg.p2g_engine == "binned")
+        if self.sparse_grid:
+            # only the blocks touched by P2G are allocated, and they are all
+            # released again at the beginning of every substep
+            block_size = self.cfg.grid_block_size
+            n_blocks = tuple(
+                (n + block_size - 1) // block_size for n in self.grid_shape)
+            self.grid_block = ti.root.pointer(grid_axes, n_blocks)
+            self.grid_block.dense(grid_axes, block_size).place(*grid_fields)
+            if self.cfg.p2g_engine == "binned":
+                # indices of the particles whose stencil starts in a block,
+                # indexed by block (not cell) coordinates
+                self.pid = ti.field(int)
+                self.bin_capacity = (block_size**self.dim *
+                                     self.cfg.max_particles_per_cell)
+                self.grid_block.dynamic(
+                    ti.axes(self.dim),
+                    self.bin_capacity,
+                    chunk_size=block_size**self.dim).place(self.pid)
+                # particles that did not fit into their block's list
+                self.n_bin_overflow = ti.field(int, shape=())
+        else:
+            ti.root.dense(grid_axes, self.grid_shape).place(*grid_fields)
         self.p_is_used = ti.field(
             int, self.max_n_particles)  # should be a boolean field
         self.p_is_used.fill(1)
+        # creation index of the particle stored in each slot. Reordering moves
+        # particles between slots, output is scattered back through p_id so
+        # every object keeps its [start_p_idx, end_p_idx) range
+        self.p_id = ti.field(int, self.max_n_particles)
+        # particles [0, n_particles) are alive, loops never look past them
+        self.n_particles = ti.field(int, shape=())
+        self.material_start = ti.field(int, shape=3)
+        self.material_end = ti.field(int, shape=3)
+        if self.dynamic:
+            # every material range is followed by the slots reserved for its
+            # emitters, up to material_cap_end. Retired slots are pushed on
+            # a free list per material, stored at the start of the range
+            self.material_cap_end = [0, 0, 0]
+            self.free_slots = ti.field(int, self.max_n_particles)
+            self.n_free = ti.field(int, shape=3)
+            # emitted particles get ids after all initial slots
+            self.next_id = self.max_n_particles
+            self.emit_carry = [0.0] * len(self.emitters)
+        if self.cfg.sleep:
+            # substeps a particle has been calm for, it sleeps from
+            # sleep_substeps on
+            self.p_calm = ti.field(int, self.max_n_particles)
+            # sleeping particles whose stencil covers a node. Unlike the grid
+            # it is kept between substeps
+            self.grid_sleep = ti.field(ti.i32, shape=self.grid_shape)
+            self.n_disturbed = ti.field(int, shape=())
+        self.sleep_history = []
 
-        # for visualization
-        self.colors = ti.Vector.field(4, float, self.max_n_particles)
+        self.profiler = PhaseProfiler()
+        # fields are allocated lazily by the first kernel launch otherwise
+        ti.lang.impl.get_runtime().materialize()
+        self.startup.lap("field_allocation")
 
-        self.objects = cfg.objects
-        self.trivial_geometry_objects = []
-        self.ply_objects = []
-        self.create_objects()
+        if init_cached:
+            print(f'loading initial state from {self.init_cache_path}')
+            self.init_object_table()
+            self.load_checkpoint(self.init_cache_path)
+        else:
+            self.create_objects()
+            if self.init_cache_path is not None:
+                self.save_checkpoint(self.init_cache_path, 0, [])
+        # includes compiling the init kernels on a cold kernel cache
+        self.startup.lap("object_init")
 
-    def create_objects(self):
-        self.set_all_unused()
+    def place_particle_fields(self):
+        # every group shares one dense SNode, i.e. is stored as an array of
+        # structs. p_is_used and p_id stay separate, they are rarely read
+        layout = self.cfg.particle_layout
+        if layout == "soa":
+            groups = [[self.x], [self.v], [self.C], [self.F], [self.Jp],
+                      [self.materials], [self.p_obj]]
+        elif layout == "aos":
+            groups = [[
+                self.x, self.v, self.C, self.F, self.Jp, self.materials,
+                self.p_obj
+            ]]
+        elif layout == "hybrid":
+            groups = [[self.x, self.v, self.C],
+                      [self.F, self.Jp, self.materials, self.p_obj]]
+        else:
+            raise Exception(f"Undefined particle layout {layout}")
+        for group in groups:
+            ti.root.dense(ti.i, self.max_n_particles).place(*group)
+
+    def load_objects(self):
         for obj in self.objects:
-            if isinstance(obj, CubeGeometry) or isinstance(obj, BallGeometry):
+            if isinstance(obj, EmitterGeometry):
+                if obj.dim != self.dim:
+                    raise Exception(
+                        f"{obj.dim}D emitter in a {self.dim}D simulation")
+                self.emitters.append(obj)
+            elif isinstance(obj, CubeGeometry) or isinstance(obj, BallGeometry):
+                if obj.dim != self.dim:
+                    raise Exception(
+                        f"{obj.dim}D geometry in a {self.dim}D simulation")
                 self.trivial_geometry_objects.append(obj)
             elif isinstance(obj, PlyGeometry):
+                if self.dim != 3:
+                    raise Exception("Ply geometry needs a 3D simulation")
                 self.ply_objects.append(obj)
             else:
                 raise Exception("Undefined object geometry")
+        for sink in self.sinks:
+            if sink.dim != self.dim:
+                raise Exception(
+                    f"{sink.dim}D sink in a {self.dim}D simulation")
 
-        next_p = 0
+    def sample_objects(self):
+        self.n_scene_particles = 0
+        for obj in self.emitters:
+            self.n_scene_particles += self.emitter_slots(obj)
+        if self.cfg.sampling not in ("random", "jittered"):
+            raise Exception(f"Unsupported sampling {self.cfg.sampling}")
+        spacing = self.particles_per_unit_volume**(-1 / self.dim)
         for obj in self.trivial_geometry_objects:
-            par_count = int(obj.volume * self.particles_per_unit_volume)
+            if self.cfg.sampling == "jittered":
+                # every object draws from its own stream, so its samples
+                # do not depend on the other objects of the scene. The
+                # members of an ensemble start from the same samples
+                n_member_objects = len(self.objects) // self.ensemble_size
+                rng = np.random.default_rng([
+                    self.cfg.seed,
+                    self.objects.index(obj) % n_member_objects
+                ])
+                points = obj.sample(spacing, rng).astype(np.float32)
+                self.trivial_points.append(points)
+                self.n_scene_particles += points.shape[0]
+            else:
+                self.trivial_points.append(None)
+                self.n_scene_particles += int(obj.volume *
+                                              self.particles_per_unit_volume)
+        for obj in self.ply_objects:
+            if obj.mesh_path is not None:
+                # trimesh is only needed for scenes with meshes
+                from MPM.mesh_sampler import sample_mesh
 
-            if isinstance(obj, CubeGeometry):
-                self.init_cube_vol(
-                    next_p,
-                    next_p + par_count,
-                    *obj.minimum,
-                    *obj.size,
-                    obj.material,
-                    *obj.color,
-                    obj.p_rho,
-                    obj.E,
-                    obj.nu,
-                    *obj.init_vel,
-                )
-            elif isinstance(obj, BallGeometry):
-                self.init_ball_vol(
+                print(f'sampling mesh {obj.mesh_path}')
+                points = sample_mesh(obj.mesh_path, obj.resize_coef,
+                                     self.particles_per_unit_volume,
+                                     self.cfg.seed, self.cfg.cache_dir)
+                self.ply_points.append(points)
+                self.n_scene_particles += points.shape[0]
+                continue
+            # a read-only float32 memory map, see create_objects
+            points = load_ply_points(obj.ply_path, self.cfg.cache_dir)
+            if self.cfg.particle_fraction < 1:
+                n_kept = max(int(points.shape[0] * self.cfg.particle_fraction),
+                             1)
+                points = points[np.linspace(0, points.shape[0] - 1,
+                                            n_kept).astype(np.int64)]
+            self.ply_points.append(points)
+            self.n_scene_particles += points.shape[0]
+
+    def emitter_slots(self, obj):
+        return int(obj.max_particles * self.cfg.particle_fraction)
+
+    def init_state_key(self):
+        # the config attributes and object parameters that shape the initial
+        # particle arrays. Material constants are looked up from the object
+        # table, which is always rebuilt, so sweeping them keeps the cache
+        def describe(value):
+            if isinstance(value, ti.Matrix):
+                value = value.to_numpy().tolist()
+            if isinstance(value, (list, tuple, np.ndarray)):
+                return [describe(v) for v in value]
+            if isinstance(value, np.generic):
+                return value.item()
+            if hasattr(value, "__dict__"):
+                return [
+                    type(value).__name__, {
+                        k: describe(v)
+                        for k, v in vars(value).items()
+                        if k not in ("start_p_idx", "end_p_idx", "p_rho", "E",
+                                     "nu", "color")
+                    }
+                ]
+            return value
+
+        attrs = ("dim", "quality", "box_size", "base_max_num_particles",
+                 "particles_per_unit_volume", "particle_fraction",
+                 "sampling", "seed", "precision", "sleep", "objects",
+                 "sinks")
+        state = {attr: describe(getattr(self.cfg, attr)) for attr in attrs}
+        # input files are identified like in the .ply cache
+        state["files"] = [[
+            path, os.stat(path).st_size,
+            os.stat(path).st_mtime_ns
+        ] for obj in self.ply_objects
+                          for path in (obj.ply_path, obj.mesh_path)
+                          if path is not None]
+        return hashlib.sha256(
+            json.dumps(state, sort_keys=True).encode()).hexdigest()[:16]
+
+    def init_object_table(self):
+        for j, obj in enumerate(self.objects):
+            self.obj_rho[j] = obj.p_rho
+            self.obj_mass[j] = obj.p_rho * self.p_vol
+            self.obj_mu_0[j] = obj.E / (2 * (1 + obj.nu))
+            self.obj_lambda_0[j] = obj.E * obj.nu / ((1 + obj.nu) *
+                                                     (1 - 2 * obj.nu))
+            self.obj_color[j] = [*obj.color, 1.0]
+
+    def create_objects(self):
+        self.set_all_unused()
+        self.init_object_table()
+
+        # particles are laid out in one contiguous range per material, so
+        # that substep can run a specialized P2G path over each range
+        next_p = 0
+        for material in (WATER, JELLY, SNOW):
+            self.material_start[material] = next_p
+            for obj, points in zip(self.trivial_geometry_objects,
+                                   self.trivial_points):
+                if obj.material != material:
+                    continue
+                par_count = int(obj.volume * self.particles_per_unit_volume)
+
+                if points is not None:
+                    par_count = points.shape[0]
+                    self.init_points_vol(
+                        points,
+                        next_p,
+                        self.objects.index(obj),
+                        obj.material,
+                        *as_vec3(obj.init_vel),
+                    )
+                elif isinstance(obj, CubeGeometry):
+                    self.init_cube_vol(
+                        next_p,
+                        next_p + par_count,
+                        *as_vec3(obj.minimum),
+                        *as_vec3(obj.size),
+                        self.objects.index(obj),
+                        obj.material,
+                        *as_vec3(obj.init_vel),
+                    )
+                elif isinstance(obj, BallGeometry):
+                    self.init_ball_vol(
+                        next_p,
+                        next_p + par_count,
+                        *as_vec3(obj.center),
+                        obj.radius,
+                        self.objects.index(obj),
+                        obj.material,
+                        *as_vec3(obj.init_vel),
+                    )
+                else:
+                    raise Exception("Undefined object geometry")
+
+                obj.start_p_idx = next_p
+                obj.end_p_idx = next_p + par_count
+                next_p += par_count
+                assert next_p <= self.max_n_particles
+
+            for obj, points in zip(self.ply_objects, self.ply_points):
+                if obj.material != material:
+                    continue
+                if ti.cfg.arch != ti.cpu:
+                    # the cached points are read-only memory maps. The CPU
+                    # backend reads them in place, other backends copy
+                    # ndarray arguments to the device and back after the
+                    # launch, which needs writable host memory
+                    points = np.array(points)
+                self.init_ply_vol(
+                    points,
                     next_p,
-                    next_p + par_count,
-                    *obj.center,
-                    obj.radius,
+                    *obj.translation,
+                    *obj.rotation,
+                    obj.resize_coef,
+                    self.objects.index(obj),
                     obj.material,
-                    *obj.color,
-                    obj.p_rho,
-                    obj.E,
-                    obj.nu,
                     *obj.init_vel,
                 )
-            else:
-                raise Exception("Undefined object geometry")
 
-            obj.start_p_idx = next_p
-            obj.end_p_idx = next_p + par_count
-            next_p += par_count
-            assert next_p <= self.max_n_particles
+                obj.start_p_idx = next_p
+                obj.end_p_idx = next_p + points.shape[0]
+                next_p += points.shape[0]
+                assert next_p <= self.max_n_particles
 
-        for obj in self.ply_objects:
-            print(f'loading ply from {obj.ply_path}')
-            pcd = o3d.io.read_point_cloud(obj.ply_path)
-            points = np.asarray(pcd.points)
-            self.init_ply_vol(
-                points,
-                next_p,
-                *obj.translation,
-                *obj.rotation,
-                obj.resize_coef,
-                obj.material,
-                *obj.color,
-                obj.p_rho,
-                obj.E,
-                obj.nu,
-                *obj.init_vel,
-            )
+            self.material_end[material] = next_p
+            if self.dynamic:
+                for obj in self.emitters:
+                    if obj.material != material:
+                        continue
+                    # emitted particles are not kept in creation order
+                    obj.start_p_idx = obj.end_p_idx = next_p
+                    next_p += self.emitter_slots(obj)
+                assert next_p <= self.max_n_particles
+                self.material_cap_end[material] = next_p
 
-            obj.start_p_idx = next_p
-            obj.end_p_idx = next_p + points.shape[0]
-            next_p += points.shape[0]
-            assert next_p <= self.max_n_particles
+        self.update_n_particles()
+
+    def update_n_particles(self):
+        self.n_particles[None] = max(self.material_end[m]
+                                     for m in (WATER, JELLY, SNOW))
 
     @ti.kernel
     def set_all_unused(self):
@@ -151,12 +483,13 @@ class SimulationRunner:
         for p in self.p_is_used:
             # particles are intialized as unused
             self.p_is_used[p] = 0
+            self.p_id[p] = p
             # unused particles are thrown away to the abyss (where your camera can not see)
-            self.x[p] = ti.Vector([533799.0, 533799.0, 533799.0])
+            self.x[p] = ti.Vector([533799.0 for _ in range(self.dim)])
             self.Jp[p] = 1
-            self.F[p] = ti.Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
-            self.C[p] = ti.Matrix([[0, 0, 0], [0, 0, 0], [0, 0, 0]])
-            self.v[p] = ti.Vector([0.0, 0.0, 0.0])
+            self.F[p] = ti.Matrix.identity(float, self.dim)
+            self.C[p] = ti.Matrix.zero(self.state_fp, self.dim, self.dim)
+            self.v[p] = ti.Vector.zero(self.state_fp, self.dim)
 
     @ti.kernel
     def init_cube_vol(
@@ -169,33 +502,23 @@ class SimulationRunner:
         x_size: float,
         y_size: float,
         z_size: float,
+        obj_id: int,
         material: int,
-        color_r: float,
-        color_g: float,
-        color_b: float,
-        p_rho: float,
-        E: float,
-        nu: float,
         init_vel_x: float,
         init_vel_y: float,
         init_vel_z: float,
     ):
         for i in range(first_par, last_par):
+            size = ti.Vector([x_size, y_size, z_size][:self.dim])
+            begin = ti.Vector([x_begin, y_begin, z_begin][:self.dim])
             self.x[i] = ti.Vector([ti.random()
-                                   for j in range(self.dim)]) * ti.Vector(
-                                       [x_size, y_size, z_size]) + ti.Vector(
-                                           [x_begin, y_begin, z_begin])
+                                   for j in range(self.dim)]) * size + begin
             self.Jp[i] = 1
-            self.F[i] = ti.Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
-            self.v[i] = ti.Vector([init_vel_x, init_vel_y, init_vel_z])
-            self.p_rho[i] = p_rho
-            self.p_mass[i] = p_rho * self.p_vol
-            self.p_E[i] = E
-            self.p_nu[i] = nu
-            self.p_mu_0[i] = E / (2 * (1 + nu))
-            self.p_lambda_0[i] = E * nu / ((1 + nu) * (1 - 2 * nu))
+            self.F[i] = ti.Matrix.identity(float, self.dim)
+            self.v[i] = ti.Vector([init_vel_x, init_vel_y, init_vel_z
+                                   ][:self.dim]).cast(self.state_fp)
+            self.p_obj[i] = ti.cast(obj_id, ti.i16)
             self.materials[i] = material
-            self.colors[i] = ti.Vector([color_r, color_g, color_b, 1.0])
             self.p_is_used[i] = 1
 
     @ti.kernel
@@ -207,39 +530,58 @@ class SimulationRunner:
         center_y: float,
         center_z: float,
         radius: float,
+        obj_id: int,
         material: int,
-        color_r: float,
-        color_g: float,
-        color_b: float,
-        p_rho: float,
-        E: float,
-        nu: float,
         init_vel_x: float,
         init_vel_y: float,
         init_vel_z: float,
     ):
         for i in range(first_par, last_par):
             theta = 2 * math.pi * ti.random()
-            phi = math.acos(1 - 2 * ti.random())
-            r = radius * (ti.random())**(1 / 3)
-            self.x[i] = ti.Vector([
-                center_x + r * math.sin(phi) * math.cos(theta),
-                center_y + r * math.sin(phi) * math.sin(theta),
-                center_z + r * math.cos(phi),
-            ])
+            if ti.static(self.dim == 2):
+                r = radius * ti.sqrt(ti.random())
+                self.x[i] = ti.Vector([
+                    center_x + r * math.cos(theta),
+                    center_y + r * math.sin(theta),
+                ])
+            else:
+                phi = math.acos(1 - 2 * ti.random())
+                r = radius * (ti.random())**(1 / 3)
+                self.x[i] = ti.Vector([
+                    center_x + r * math.sin(phi) * math.cos(theta),
+                    center_y + r * math.sin(phi) * math.sin(theta),
+                    center_z + r * math.cos(phi),
+                ])
             self.Jp[i] = 1
-            self.F[i] = ti.Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
-            self.v[i] = ti.Vector([init_vel_x, init_vel_y, init_vel_z])
-            self.p_rho[i] = p_rho
-            self.p_mass[i] = p_rho * self.p_vol
-            self.p_E[i] = E
-            self.p_nu[i] = nu
-            self.p_mu_0[i] = E / (2 * (1 + nu))
-            self.p_lambda_0[i] = E * nu / ((1 + nu) * (1 - 2 * nu))
+            self.F[i] = ti.Matrix.identity(float, self.dim)
+            self.v[i] = ti.Vector([init_vel_x, init_vel_y, init_vel_z
+                                   ][:self.dim]).cast(self.state_fp)
+            self.p_obj[i] = ti.cast(obj_id, ti.i16)
             self.materials[i] = material
-            self.colors[i] = ti.Vector([color_r, color_g, color_b, 1.0])
             self.p_is_used[i] = 1
 
+    @ti.kernel
+    def init_points_vol(
+        self,
+        points: ti.types.ndarray(),
+        first_par: int,
+        obj_id: int,
+        material: int,
+        init_vel_x: float,
+        init_vel_y: float,
+        init_vel_z: float,
+    ):
+        for i in range(points.shape[0]):
+            p = first_par + i
+            self.x[p] = ti.Vector([points[i, j] for j in range(self.dim)])
+            self.Jp[p] = 1
+            self.F[p] = ti.Matrix.identity(float, self.dim)
+            self.v[p] = ti.Vector([init_vel_x, init_vel_y, init_vel_z
+                                   ][:self.dim]).cast(self.state_fp)
+            self.p_obj[p] = ti.cast(obj_id, ti.i16)
+            self.materials[p] = material
+            self.p_is_used[p] = 1
+
     @ti.kernel
     def init_ply_vol(
         self,
@@ -252,13 +594,8 @@ class SimulationRunner:
         rotation_y: float,
         rotation_z: float,
         resize_coef: float,
+        obj_id: int,
         material: int,
-        color_r: float,
-        color_g: float,
-        color_b: float,
-        p_rho: float,
-        E: float,
-        nu: float,
         init_vel_x: float,
         init_vel_y: float,
         init_vel_z: float,
@@ -271,109 +608,578 @@ class SimulationRunner:
 
             self.Jp[first_par + i] = 1
             self.F[first_par + i] = ti.Matrix([[1, 0, 0], [0, 1, 0], [0, 0, 1]])
-            self.v[first_par + i] = ti.Vector([init_vel_x, init_vel_y, init_vel_z])
-            self.p_rho[first_par + i] = p_rho
-            self.p_mass[first_par + i] = p_rho * self.p_vol
-            self.p_E[first_par + i] = E
-            self.p_nu[first_par + i] = nu
-            self.p_mu_0[first_par + i] = E / (2 * (1 + nu))
-            self.p_lambda_0[first_par + i] = E * nu / ((1 + nu) * (1 - 2 * nu))
+            self.v[first_par + i] = ti.Vector(
+                [init_vel_x, init_vel_y, init_vel_z]).cast(self.state_fp)
+            self.p_obj[first_par + i] = ti.cast(obj_id, ti.i16)
             self.materials[first_par + i] = material
-            self.colors[first_par + i] = ti.Vector([color_r, color_g, color_b, 1.0])
             self.p_is_used[first_par + i] = 1
 
     @ti.kernel
+    def emit_particles(
+        self,
+        positions: ti.types.ndarray(),
+        free_top: int,
+        n_from_free: int,
+        append_start: int,
+        obj_id: int,
+        material: int,
+        init_vel_x: float,
+        init_vel_y: float,
+        init_vel_z: float,
+        first_id: int,
+    ):
+        # the first n_from_free particles are popped from the free list that
+        # ends at free_top, the others are appended from append_start on
+        for i in range(positions.shape[0]):
+            p = append_start + i - n_from_free
+            if i < n_from_free:
+                p = self.free_slots[free_top - 1 - i]
+            self.x[p] = ti.Vector([positions[i, j] for j in range(self.dim)])
+            self.Jp[p] = 1
+            self.F[p] = ti.Matrix.identity(float, self.dim)
+            self.C[p] = ti.Matrix.zero(self.state_fp, self.dim, self.dim)
+            self.v[p] = ti.Vector([init_vel_x, init_vel_y, init_vel_z
+                                   ][:self.dim]).cast(self.state_fp)
+            self.p_obj[p] = ti.cast(obj_id, ti.i16)
+            self.materials[p] = material
+            self.p_is_used[p] = 1
+            self.p_id[p] = first_id + i
+
+    @ti.kernel
+    def retire_particles(
+        self,
+        x_begin: float,
+        y_begin: float,
+        z_begin: float,
+        x_size: float,
+        y_size: float,
+        z_size: float,
+    ):
+        size = ti.Vector([x_size, y_size, z_size][:self.dim])
+        begin = ti.Vector([x_begin, y_begin, z_begin][:self.dim])
+        for p in range(self.n_particles[None]):
+            rel = self.x[p] - begin
+            inside = self.p_is_used[p] != 0
+            for d in ti.static(range(self.dim)):
+                if rel[d] < 0 or rel[d] > size[d]:
+                    inside = False
+            if inside:
+                if ti.static(self.cfg.sleep):
+                    if not self.is_awake(p):
+                        self.mark_sleeping(p, -1)
+                    self.p_calm[p] = 0
+                self.p_is_used[p] = 0
+                self.x[p] = ti.Vector([533799.0 for _ in range(self.dim)])
+                self.v[p] = ti.Vector.zero(self.state_fp, self.dim)
+                m = self.materials[p]
+                self.free_slots[self.material_start[m] +
+                                ti.atomic_add(self.n_free[m], 1)] = p
+
+    def update_flow(self):
+        # sinks push the slots they retire on the free list of the material,
+        # emitters reuse those slots first and then take reserved ones
+        for sink in self.sinks:
+            self.retire_particles(*as_vec3(sink.minimum), *as_vec3(sink.size))
+        for j, obj in enumerate(self.emitters):
+            self.emit_carry[j] += (obj.flow_rate * self.frame_dt *
+                                   self.particles_per_unit_volume)
+            count = int(self.emit_carry[j])
+            self.emit_carry[j] -= count
+            m = obj.material
+            n_free, end = self.n_free[m], self.material_end[m]
+            count = min(count, n_free + self.material_cap_end[m] - end)
+            if count <= 0:
+                continue
+            n_from_free = min(count, n_free)
+            # sampled on the host from the particle ids, so that a resumed
+            # run emits the same particles
+            rng = np.random.default_rng([self.cfg.seed, self.next_id])
+            positions = (np.asarray(list(obj.minimum)) +
+                         rng.random((count, self.dim)) *
+                         np.asarray(list(obj.size))).astype(np.float32)
+            self.emit_particles(
+                positions,
+                self.material_start[m] + n_free,
+                n_from_free,
+                end,
+                self.objects.index(obj),
+                m,
+                *as_vec3(obj.init_vel),
+                self.next_id,
+            )
+            self.next_id += count
+            self.n_free[m] = n_free - n_from_free
+            self.material_end[m] = end + count - n_from_free
+        self.update_n_particles()
+
+    @ti.kernel
+    def count_alive(self) -> int:
+        n = 0
+        for p in range(self.n_particles[None]):
+            if self.p_is_used[p] != 0:
+                n += 1
+        return n
+
+    def advance_frame(self):
+        if self.dynamic:
+            self.update_flow()
+        if not self.cfg.adaptive_dt:
+            self.advance(self.cfg.substeps_per_frame)
+            return self.cfg.substeps_per_frame
+
+        # adaptive mode: take the largest stable substep, but shorten the
+        # last one so that the frame ends exactly at frame_dt
+        t, n_substeps = 0.0, 0
+        while self.frame_dt - t > 1e-12:
+            dt = min(self.cfl_dt(), self.frame_dt - t)
+            self.dt[None] = dt
+            self.advance(1)
+            self.dt_history.append(dt)
+            t += dt
+            n_substeps += 1
+        return n_substeps
+
+    def cfl_dt(self):
+        max_dt = self.frame_dt
+        if self.cfg.max_dt is not None:
+            max_dt = min(self.cfg.max_dt, max_dt)
+        max_speed = self.max_wave_speed()
+        if max_speed <= 0:
+            return max_dt
+        return min(self.cfg.cfl * self.dx / max_speed, max_dt)
+
+    @ti.kernel
+    def max_wave_speed(self) -> float:
+        # particle speed plus the elastic wave speed sqrt((lambda + 2 mu) / rho)
+        # with the same hardening factors that p2g applies
+        max_speed = 0.0
+        for p in range(self.n_particles[None]):
+            if not self.is_alive(p):
+                continue
+            h = 1.0
+            if self.materials[p] == SNOW:
+                h = ti.exp(10 * (1.0 - self.Jp[p]))
+            elif self.materials[p] == JELLY:
+                h = 0.3
+            o = self.obj_index(p)
+            stiffness = self.obj_lambda_0[o]
+            if self.materials[p] != WATER:
+                stiffness += 2 * self.obj_mu_0[o]
+            c = ti.sqrt(stiffness * h / self.obj_rho[o])
+            ti.atomic_max(max_speed, self.v[p].cast(float).norm() + c)
+        return max_speed
+
+    def advance(self, n_substeps):
+        # fused launches run whole substeps in a single kernel, the profiler
+        # needs the per-phase kernels to time each phase
+        n = self.cfg.substeps_per_launch
+        if not self.profiler.enabled:
+            for _ in range(n_substeps // n):
+                self.fused_substeps()
+            n_substeps %= n
+        for _ in range(n_substeps):
+            self.substep()
+        if self.cfg.p2g_engine == "binned" and self.n_bin_overflow[None]:
+            raise Exception(
+                f"{self.n_bin_overflow[None]} particles did not fit into "
+                "their grid block, increase max_particles_per_cell")
+
     def substep(self):
-        for i, j, k in self.grid_m:
-            self.grid_v[i, j, k] = [0, 0, 0]
-            self.grid_m[i, j, k] = 0
-
-        # P2G step
-        for p in self.x:
-            # LOOKATME: do not swap the branch stmt with the for-loop, because ONLY the outermost loop stmt can be parallized.
-            if self.p_is_used[p]:
-                base = (self.x[p] * self.inv_dx - 0.5).cast(int)
-                fx = self.x[p] * self.inv_dx - base.cast(float)
-                w = [
-                    0.5 * (1.5 - fx)**2, 0.75 - (fx - 1)**2,
-                    0.5 * (fx - 0.5)**2
-                ]
-                affine = ti.Matrix.zero(float, self.dim, self.dim)
-                self.F[p] = (ti.Matrix.identity(float, 3) +
-                                self.dt * self.C[p]) @ self.F[p]
-                h = 1.0
-                if self.materials[p] == SNOW:
-                    h = ti.exp(10 * (1.0 - self.Jp[p]))
-                elif self.materials[p] == JELLY:
-                    h = 0.3
-                mu, la = self.p_mu_0[p] * h, self.p_lambda_0[p] * h
-                if self.materials[p] == WATER:
-                    mu = 0.0
-                U, sig, V = ti.svd(self.F[p])
-                J = 1.0
-                for d in ti.static(range(3)):
-                    new_sig = sig[d, d]
-                    if self.materials[p] == SNOW:
-                        new_sig = ti.min(ti.max(sig[d, d], 1 - 2.5e-2),
-                                            1 + 4.5e-3)
-                    self.Jp[p] *= sig[d, d] / new_sig
-                    sig[d, d] = new_sig
-                    J *= new_sig
-                if self.materials[p] == WATER:
-                    self.F[p] = ti.Matrix.identity(float, 3)
-                    self.F[p][0, 0] = J
-                    self.Jp[p] = J
-                elif self.materials[p] == SNOW:
-                    self.F[p] = U @ sig @ V.transpose()
-                stress = 2 * mu * (
-                    self.F[p] - U @ V.transpose()) @ self.F[p].transpose(
-                    ) + ti.Matrix.identity(float, 3) * la * J * (J - 1)
-                stress = (-self.dt * self.p_vol * 4 * self.inv_dx *
-                            self.inv_dx) * stress
-                affine = stress + self.p_mass[p] * self.C[p]
-
-                for i, j, k in ti.static(ti.ndrange(3, 3, 3)):
-                    offset = ti.Vector([i, j, k])
-                    dpos = (offset.cast(float) - fx) * self.dx
-                    weight = w[i].x * w[j].y * w[k].z
-                    self.grid_v[base + offset] += weight * (
-                        self.p_mass[p] * self.v[p] + affine @ dpos)
-                    self.grid_m[base + offset] += weight * self.p_mass[p]
-
-        # Grid operation
+        with self.profiler.phase("clear_grid"):
+            self.clear_grid()
+        with self.profiler.phase("p2g"):
+            self.p2g()
+        with self.profiler.phase("grid_op"):
+            self.grid_op()
+        with self.profiler.phase("g2p"):
+            self.g2p()
+        if self.profiler.enabled:
+            self.profiler.count_substep(self.n_particles[None],
+                                        self.count_grid_cells())
+
+    def count_grid_cells(self):
+        if self.sparse_grid:
+            return self.count_active_grid_cells()
+        return int(np.prod(self.grid_shape))
+
+    @ti.kernel
+    def count_active_grid_cells(self) -> int:
+        n = 0
+        for I in ti.grouped(self.grid_m):
+            n += 1
+        return n
+
+    @ti.kernel
+    def fused_substeps(self):
+        # unrolled at compile time, so every loop below stays a top-level
+        # (parallel) loop of this single kernel
+        for _ in ti.static(range(self.cfg.substeps_per_launch)):
+            self.clear_grid_step()
+            self.p2g_step()
+            self.grid_op_step()
+            self.g2p_step()
+
+    @ti.kernel
+    def clear_grid(self):
+        self.clear_grid_step()
+
+    @ti.kernel
+    def p2g(self):
+        self.p2g_step()
+
+    @ti.kernel
+    def grid_op(self):
+        self.grid_op_step()
+
+    @ti.kernel
+    def g2p(self):
+        self.g2p_step()
+
+    @ti.func
+    def clear_grid_step(self):
+        if ti.static(self.sparse_grid):
+            for I in ti.grouped(self.grid_block):
+                ti.deactivate(self.grid_block, I)
+        else:
+            for I in ti.grouped(self.grid_m):
+                self.grid_v[I] = ti.Vector.zero(float, self.dim)
+                self.grid_m[I] = 0
+                if ti.static(self.cfg.sleep):
+                    self.grid_disturbed[I] = 0
+        if ti.static(self.cfg.sleep):
+            self.n_disturbed[None] = 0
+
+    @ti.func
+    def stencil_base(self, x):
+        return (x * self.inv_dx - self.stencil_shift).cast(int)
+
+    @ti.func
+    def linear_weight(self, w: ti.template(), offset: ti.template()):
+        # weight of a node in the linear B-spline stencil, and its gradient
+        weight = 1.0
+        grad = ti.Vector.zero(float, self.dim)
+        for d in ti.static(range(self.dim)):
+            weight *= w[offset[d]][d]
+            g = self.inv_dx * (2 * offset[d] - 1)
+            for e in ti.static(range(self.dim)):
+                if ti.static(e != d):
+                    g *= w[offset[e]][e]
+            grad[d] = g
+        return weight, grad
+
+    @ti.func
+    def p2g_scatter(self, p, base, stress):
+        if ti.static(self.cfg.transfer_kernel == "linear"):
+            self.linear_p2g_scatter(p, base, stress)
+        else:
+            self.quadratic_p2g_scatter(p, base, stress)
+
+    # the linear stencil has no constant inertia tensor, so unlike the
+    # quadratic MLS update below, stress is applied through the weight
+    # gradients and C is the velocity gradient
+    @ti.func
+    def linear_p2g_scatter(self, p, base, stress):
+        fx = self.x[p] * self.inv_dx - base.cast(float)
+        w = [1 - fx, fx]
+        force = -self.dt[None] * self.p_vol * stress
+        mass = self.obj_mass[self.obj_index(p)]
+
+        for offset in ti.static(
+                ti.grouped(ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+            dpos = (offset.cast(float) - fx) * self.dx
+            weight, grad = self.linear_weight(w, offset)
+            self.grid_v[base + offset] += weight * mass * (
+                self.v[p] + self.C[p] @ dpos) + force @ grad
+            self.grid_m[base + offset] += weight * mass
+
+    @ti.func
+    def quadratic_p2g_scatter(self, p, base, stress):
+        fx = self.x[p] * self.inv_dx - base.cast(float)
+        w = [0.5 * (1.5 - fx)**2, 0.75 - (fx - 1)**2, 0.5 * (fx - 0.5)**2]
+        stress = (-self.dt[None] * self.p_vol * 4 * self.inv_dx *
+                  self.inv_dx) * stress
+        mass = self.obj_mass[self.obj_index(p)]
+        affine = stress + mass * self.C[p]
+
+        for offset in ti.static(
+                ti.grouped(ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+            dpos = (offset.cast(float) - fx) * self.dx
+            weight = 1.0
+            for d in ti.static(range(self.dim)):
+                weight *= w[offset[d]][d]
+            self.grid_v[base + offset] += weight * (
+                mass * self.v[p] + affine @ dpos)
+            self.grid_m[base + offset] += weight * mass
+
+    # stress of one particle, also updates its deformation state.
+    # water only needs its volume ratio J, which is kept in Jp; F is never
+    # read for water, so no SVD is needed
+    @ti.func
+    def water_stress(self, p):
+        J = (ti.Matrix.identity(float, self.dim) +
+             self.dt[None] * self.C[p]).determinant() * self.Jp[p]
+        self.Jp[p] = J
+        la = self.obj_lambda_0[self.obj_index(p)]
+        return ti.Matrix.identity(float, self.dim) * la * J * (J - 1)
+
+    # jelly: fixed corotated elasticity without plasticity
+    @ti.func
+    def jelly_stress(self, p):
+        self.F[p] = (ti.Matrix.identity(float, self.dim) +
+                     self.dt[None] * self.C[p]) @ self.F[p]
+        o = self.obj_index(p)
+        mu, la = self.obj_mu_0[o] * 0.3, self.obj_lambda_0[o] * 0.3
+        U, sig, V = ti.svd(self.F[p])
+        J = 1.0
+        for d in ti.static(range(self.dim)):
+            J *= sig[d, d]
+        return 2 * mu * (self.F[p] - U @ V.transpose()) @ self.F[p].transpose(
+        ) + ti.Matrix.identity(float, self.dim) * la * J * (J - 1)
+
+    # snow: fixed corotated elasticity with clamped singular values
+    @ti.func
+    def snow_stress(self, p):
+        self.F[p] = (ti.Matrix.identity(float, self.dim) +
+                     self.dt[None] * self.C[p]) @ self.F[p]
+        h = ti.exp(10 * (1.0 - self.Jp[p]))
+        o = self.obj_index(p)
+        mu, la = self.obj_mu_0[o] * h, self.obj_lambda_0[o] * h
+        U, sig, V = ti.svd(self.F[p])
+        J = 1.0
+        for d in ti.static(range(self.dim)):
+            new_sig = ti.min(ti.max(sig[d, d], 1 - 2.5e-2), 1 + 4.5e-3)
+            self.Jp[p] *= sig[d, d] / new_sig
+            sig[d, d] = new_sig
+            J *= new_sig
+        self.F[p] = U @ sig @ V.transpose()
+        return 2 * mu * (self.F[p] - U @ V.transpose()) @ self.F[p].transpose(
+        ) + ti.Matrix.identity(float, self.dim) * la * J * (J - 1)
+
+    @ti.func
+    def p2g_step(self):
+        if ti.static(self.cfg.p2g_engine == "binned"):
+            self.binned_p2g()
+        else:
+            # one loop per material range
+            for p in range(self.material_start[WATER],
+                           self.material_end[WATER]):
+                if self.is_alive(p) and self.is_awake(p):
+                    self.p2g_scatter(p, self.stencil_base(self.x[p]),
+                                     self.water_stress(p))
+            for p in range(self.material_start[JELLY],
+                           self.material_end[JELLY]):
+                if self.is_alive(p) and self.is_awake(p):
+                    self.p2g_scatter(p, self.stencil_base(self.x[p]),
+                                     self.jelly_stress(p))
+            for p in range(self.material_start[SNOW], self.material_end[SNOW]):
+                if self.is_alive(p) and self.is_awake(p):
+                    self.p2g_scatter(p, self.stencil_base(self.x[p]),
+                                     self.snow_stress(p))
+
+    @ti.func
+    def binned_p2g(self):
+        # bin the particles by the grid block of their stencil base; the
+        # lists live under the block pointer, so clearing the grid empties
+        # them as well
+        for p in range(self.n_particles[None]):
+            if self.is_alive(p) and self.is_awake(p):
+                base = self.stencil_base(self.x[p])
+                slot = ti.append(self.pid.parent(),
+                                 base // self.cfg.grid_block_size, p)
+                if slot >= self.bin_capacity:
+                    self.n_bin_overflow[None] += 1
+
+        # particles of one block scatter into a block-local scratch copy of
+        # the grid, which is written back once per block
+        for d in ti.static(range(self.dim)):
+            ti.block_local(self.grid_v.get_scalar_field(d))
+        ti.block_local(self.grid_m)
+        for I in ti.grouped(self.pid):
+            p = self.pid[I]
+            # the stencil base lies in the block of the list, which bounds
+            # the block-local scratch memory
+            base = self.stencil_base(self.x[p])
+            for d in ti.static(range(self.dim)):
+                base[d] = ti.assume_in_range(
+                    base[d], I[d] * self.cfg.grid_block_size, 0,
+                    self.cfg.grid_block_size)
+            stress = ti.Matrix.zero(float, self.dim, self.dim)
+            if self.materials[p] == WATER:
+                stress = self.water_stress(p)
+            elif self.materials[p] == JELLY:
+                stress = self.jelly_stress(p)
+            else:
+                stress = self.snow_stress(p)
+            self.p2g_scatter(p, base, stress)
+
+    @ti.func
+    def grid_op_step(self):
         for I in ti.grouped(self.grid_m):
             if self.grid_m[I] > 0:
                 self.grid_v[I] /= self.grid_m[I]
-                self.grid_v[I].y += self.dt * self.gravity
+                self.grid_v[I].y += self.dt[None] * self.gravity
                 for d in ti.static(range(self.dim)):
-                    if I[d] < 3 and self.grid_v[I][d] < 0:
+                    i = I[d]
+                    if ti.static(d == 0 and self.ensemble_size > 1):
+                        # every member has its own walls
+                        i = I[d] % self.member_pitch_nodes
+                    if i < 3 and self.grid_v[I][d] < 0:
                         self.grid_v[I][d] = 0
-                    if (I[d]
-                            > self.n_grid_per_length * self.cfg.box_size[d] - 3
-                            and self.grid_v[I][d] > 0):
+                    if (i > self.n_grid_per_length * self.member_box_size[d] -
+                            3 and self.grid_v[I][d] > 0):
                         self.grid_v[I][d] = 0
+                if ti.static(self.cfg.sleep):
+                    # sleeping material is a floor for the awake particles:
+                    # the velocity component into it is removed at the nodes
+                    # around it, unless the awake particles arriving there
+                    # are fast enough to wake it. Sliding along it and lifting
+                    # off are kept
+                    if self.grid_sleep[I] > 0:
+                        n = self.sleep_normal(I)
+                        v_in = -self.grid_v[I].dot(n)
+                        if n.norm_sqr() == 0:
+                            # inside the sleeping material every direction
+                            # points into it
+                            v_in = self.grid_v[I].norm()
+                        if v_in > self.cfg.wake_velocity:
+                            self.grid_disturbed[I] = 1
+                            self.n_disturbed[None] += 1
+                        if n.norm_sqr() == 0:
+                            self.grid_v[I] = ti.Vector.zero(float, self.dim)
+                        elif v_in > 0:
+                            self.grid_v[I] += v_in * n
 
-        # G2P step
-        for p in self.x:
-            if self.p_is_used[p]:
-                base = (self.x[p] * self.inv_dx - 0.5).cast(int)
-                fx = self.x[p] * self.inv_dx - base.cast(float)
+    @ti.func
+    def g2p_step(self):
+        for p in range(self.n_particles[None]):
+            if not self.is_alive(p):
+                continue
+            if not self.wake_check(p):
+                continue
+            base = self.stencil_base(self.x[p])
+            fx = self.x[p] * self.inv_dx - base.cast(float)
+            new_v = ti.Vector.zero(float, self.dim)
+            new_C = ti.Matrix.zero(float, self.dim, self.dim)
+            if ti.static(self.cfg.transfer_kernel == "linear"):
+                w = [1 - fx, fx]
+                for offset in ti.static(
+                        ti.grouped(
+                            ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+                    g_v = self.grid_v[base + offset]
+                    weight, grad = self.linear_weight(w, offset)
+                    new_v += weight * g_v
+                    new_C += g_v.outer_product(grad)
+            else:
                 w = [
                     0.5 * (1.5 - fx)**2,
                     0.75 - (fx - 1.0)**2,
                     0.5 * (fx - 0.5)**2,
                 ]
-                new_v = ti.Vector.zero(float, 3)
-                new_C = ti.Matrix.zero(float, 3, 3)
-                for i, j, k in ti.static(ti.ndrange(3, 3, 3)):
-                    dpos = ti.Vector([i, j, k]).cast(float) - fx
-                    g_v = self.grid_v[base + ti.Vector([i, j, k])]
-                    weight = w[i].x * w[j].y * w[k].z
+                for offset in ti.static(
+                        ti.grouped(
+                            ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+                    dpos = offset.cast(float) - fx
+                    g_v = self.grid_v[base + offset]
+                    weight = 1.0
+                    for d in ti.static(range(self.dim)):
+                        weight *= w[offset[d]][d]
                     new_v += weight * g_v
-                    new_C += 4 * self.inv_dx * weight * g_v.outer_product(dpos)
-                self.v[p], self.C[p] = new_v, new_C
-                self.x[p] += self.dt * self.v[p]  # advection
-                # self.Jp[p] *= 1 + self.dt * self.C[p].trace()
+                    new_C += 4 * self.inv_dx * weight * g_v.outer_product(
+                        dpos)
+            self.v[p] = new_v.cast(self.state_fp)
+            self.C[p] = new_C.cast(self.state_fp)
+            self.x[p] += self.dt[None] * new_v  # advection
+            # self.Jp[p] *= 1 + self.dt[None] * self.C[p].trace()
+            if ti.static(self.cfg.sleep):
+                self.update_calm(p, new_v, new_C)
+
+    @ti.func
+    def obj_index(self, p):
+        # p_obj is stored as i16, fields are indexed with i32
+        return ti.cast(self.p_obj[p], ti.i32)
+
+    @ti.func
+    def is_alive(self, p):
+        alive = True
+        if ti.static(self.dynamic):
+            alive = self.p_is_used[p] != 0
+        return alive
+
+    @ti.func
+    def is_awake(self, p):
+        awake = True
+        if ti.static(self.cfg.sleep):
+            awake = self.p_calm[p] < self.cfg.sleep_substeps
+        return awake
+
+    @ti.func
+    def wake_check(self, p):
+        # True for awake particles and for sleeping ones that are woken by a
+        # disturbed node in their stencil
+        awake = self.is_awake(p)
+        if ti.static(self.cfg.sleep):
+            if not awake and self.n_disturbed[None] > 0:
+                base = self.stencil_base(self.x[p])
+                for offset in ti.static(
+                        ti.grouped(
+                            ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+                    if self.grid_disturbed[base + offset] != 0:
+                        awake = True
+                if awake:
+                    self.p_calm[p] = 0
+                    self.mark_sleeping(p, -1)
+        return awake
+
+    @ti.func
+    def update_calm(self, p, v, C):
+        if (v.norm() < self.cfg.sleep_velocity
+                and C.norm() < self.cfg.sleep_strain_rate):
+            self.p_calm[p] += 1
+            if self.p_calm[p] == self.cfg.sleep_substeps:
+                # falls asleep where it is and holds its neighbors up
+                self.v[p] = ti.Vector.zero(self.state_fp, self.dim)
+                self.C[p] = ti.Matrix.zero(self.state_fp, self.dim, self.dim)
+                self.mark_sleeping(p, 1)
+        else:
+            self.p_calm[p] = 0
+
+    @ti.func
+    def sleep_normal(self, I):
+        # outward normal of the sleeping material at node I, along the
+        # negative gradient of grid_sleep. Zero inside the material
+        grad = ti.Vector.zero(float, self.dim)
+        for d in ti.static(range(self.dim)):
+            lo, hi = I, I
+            lo[d] = ti.max(I[d] - 1, 0)
+            hi[d] = ti.min(I[d] + 1, self.grid_shape[d] - 1)
+            grad[d] = self.grid_sleep[lo] - self.grid_sleep[hi]
+        n = ti.Vector.zero(float, self.dim)
+        if grad.norm_sqr() > 0:
+            n = grad.normalized()
+        return n
+
+    @ti.func
+    def mark_sleeping(self, p, delta):
+        base = self.stencil_base(self.x[p])
+        for offset in ti.static(
+                ti.grouped(ti.ndrange(*((self.stencil_size, ) * self.dim)))):
+            self.grid_sleep[base + offset] += delta
+
+    @ti.kernel
+    def rebuild_grid_sleep(self):
+        for I in ti.grouped(self.grid_sleep):
+            self.grid_sleep[I] = 0
+        for p in range(self.n_particles[None]):
+            if not self.is_awake(p):
+                self.mark_sleeping(p, 1)
+
+    @ti.kernel
+    def count_sleeping(self) -> int:
+        n = 0
+        for p in range(self.n_particles[None]):
+            if not self.is_awake(p):
+                n += 1
+        return n
 
     def run(self, run_args):
         self.run_args = run_args
@@ -381,54 +1187,459 @@ class SimulationRunner:
         # initialize visalization settings
         if self.run_args.visualize:
             res = (1080, 720)
-            self.window = ti.ui.Window("MPM 3D", res, vsync=True)
+            self.window = ti.ui.Window(f"MPM {self.dim}D", res, vsync=True)
             self.canvas = self.window.get_canvas()
             gui = self.window.get_gui()
-            self.scene = ti.ui.Scene()
-            self.camera = ti.ui.Camera()
-            self.camera.position(0.5, 1.0, 1.95)
-            self.camera.lookat(0.5, 0.3, 0.5)
-            self.camera.fov(55)
+            if self.dim == 3:
+                self.scene = ti.ui.Scene()
+                self.camera = ti.ui.Camera()
+                self.camera.position(0.5, 1.0, 1.95)
+                self.camera.lookat(0.5, 0.3, 0.5)
+                self.camera.fov(55)
+            else:
+                # the canvas shows [0, 1]^2, the box is scaled to fit it
+                self.screen_x = ti.Vector.field(2, float,
+                                                self.max_n_particles)
+                self.screen_scale = 1.0 / max(self.cfg.box_size[:2])
             self.particles_radius = 0.01 / 2**(self.quality - 1)
+            # per-vertex colors are only needed for drawing, they are looked
+            # up from the object table every frame
+            self.colors = ti.Vector.field(4, float, self.max_n_particles)
 
-        if self.run_args.store_output:
-            self.output_dir = f"output/{self.run_args.scenario}"
-            import os
-            import shutil
+        # previews never overwrite the output of full quality runs
+        self.output_name = self.run_args.scenario
+        if self.preview:
+            self.output_name += "_preview"
+        self.checkpoint_path = f"output/{self.output_name}_checkpoint.npz"
+        start_frame = 0
+        frame_substeps = []
+        if self.run_args.resume:
+            start_frame, frame_substeps = self.load_checkpoint(
+                self.checkpoint_path)
+            print(f"resuming from {self.checkpoint_path} at frame "
+                  f"{start_frame}")
 
+        if self.run_args.store_output:
+            self.output_dir = f"output/{self.output_name}"
             os.makedirs(self.output_dir, exist_ok=True)
-            shutil.rmtree(self.output_dir)
-            os.makedirs(self.output_dir, exist_ok=True)
+            # a resumed run keeps the frames written before the checkpoint
+            if not self.run_args.resume:
+                shutil.rmtree(self.output_dir)
+                os.makedirs(self.output_dir, exist_ok=True)
+
+        self.profiler.enabled = self.run_args.profile
+
+        # frames are written on a background thread unless the queue size
+        # is 0
+        self.frame_writer = None
+        self.frame_buffer = None
+        if (self.run_args.store_output
+                and self.run_args.output_queue_size > 0):
+            self.frame_writer = AsyncFrameWriter(
+                self.make_frame_buffer, self.run_args.output_queue_size)
+
+        self.startup.lap("run_setup")
 
         # run simulation
-        for i in tqdm(range(self.run_args.simulation_steps)):
-            for s in range(100):
-                self.substep()
-            self.render()
-
-            # output .ply files
-            if self.run_args.store_output:
-                np_x = self.x.to_numpy()
-                for j, obj in enumerate(self.objects):
-                    writer = ti.tools.PLYWriter(num_vertices=obj.end_p_idx -
-                                                obj.start_p_idx)
-                    writer.add_vertex_pos(
-                        np_x[obj.start_p_idx:obj.end_p_idx, 0],
-                        np_x[obj.start_p_idx:obj.end_p_idx, 1],
-                        np_x[obj.start_p_idx:obj.end_p_idx, 2],
-                    )
-                    os.makedirs(self.output_dir + f"/{i:06}", exist_ok=True)
-                    writer.export_ascii(self.output_dir +
-                                        f"/{i:06}/particle_object_{j}.ply")
+        progress = tqdm(range(start_frame, self.run_args.simulation_steps),
+                        initial=start_frame,
+                        total=self.run_args.simulation_steps)
+        try:
+            for i in progress:
+                frame_substeps.append(self.advance_frame())
+                self.render()
+                if self.profiler.enabled and i == start_frame:
+                    self.startup.lap("first_frame")
+                    self.profiler.startup = self.startup.stages
+                    if i == self.run_args.simulation_steps - 1:
+                        progress.write(self.startup.report())
+                elif self.profiler.enabled and i == start_frame + 1:
+                    # the first frame compiles the substep kernels on a cold
+                    # kernel cache, the second one is a steady frame
+                    self.startup.split("first_frame", self.startup.elapsed(),
+                                       "compile")
+                    progress.write(self.startup.report())
+
+                postfix = {}
+                if self.profiler.enabled:
+                    frame = self.profiler.end_frame()
+                    postfix = {
+                        name: f"{t * 1e3:.1f}ms"
+                        for name, t in frame["phase_time"].items()
+                    }
+                elif self.cfg.adaptive_dt:
+                    postfix["substeps"] = frame_substeps[-1]
+                if self.cfg.sleep:
+                    n_sleeping = self.count_sleeping()
+                    self.sleep_history.append({
+                        "frame": i,
+                        "active": self.count_alive() - n_sleeping,
+                        "sleeping": n_sleeping,
+                    })
+                    postfix["sleeping"] = n_sleeping
+                if postfix:
+                    progress.set_postfix(postfix)
+
+                if (self.cfg.reorder_interval > 0
+                        and (i + 1) % self.cfg.reorder_interval == 0):
+                    self.reorder_particles()
+                elif (self.dynamic and self.cfg.compact_interval > 0
+                      and (i + 1) % self.cfg.compact_interval == 0):
+                    self.compact_particles()
+
+                if self.run_args.store_output:
+                    self.store_frame(i)
+
+                if (self.run_args.checkpoint_interval > 0 and
+                    (i + 1) % self.run_args.checkpoint_interval == 0):
+                    # --resume continues after the checkpoint, so every frame
+                    # before it has to be on disk first
+                    if self.frame_writer is not None:
+                        self.frame_writer.flush()
+                    self.save_checkpoint(self.checkpoint_path, i + 1,
+                                         frame_substeps)
+        finally:
+            # flush the queued frames, also on errors and Ctrl-C
+            if self.frame_writer is not None:
+                self.frame_writer.close()
+
+        if self.cfg.adaptive_dt:
+            os.makedirs("output", exist_ok=True)
+            dt_path = f"output/{self.output_name}_dt_history.json"
+            with open(dt_path, "w") as f:
+                json.dump(
+                    {
+                        "fixed_dt": self.cfg.dt,
+                        "frame_dt": self.frame_dt,
+                        "frame_substeps": frame_substeps,
+                        "dt": self.dt_history,
+                    }, f)
+            n_fixed = self.cfg.substeps_per_frame * len(frame_substeps)
+            # no substep was taken if no frame ran
+            dt_range = (f"dt range [{min(self.dt_history):.2e}, "
+                        f"{max(self.dt_history):.2e}]"
+                        if self.dt_history else "no substeps")
+            print(f"adaptive dt: {sum(frame_substeps)} substeps instead of "
+                  f"{n_fixed} with fixed dt={self.cfg.dt:.2e}, {dt_range}, "
+                  f"history written to {dt_path}")
+
+        if self.cfg.sleep:
+            os.makedirs("output", exist_ok=True)
+            sleep_path = f"output/{self.output_name}_sleep.json"
+            with open(sleep_path, "w") as f:
+                json.dump(self.sleep_history, f)
+            print(f"active/sleeping particles per frame written to "
+                  f"{sleep_path}")
+
+        if self.profiler.enabled:
+            os.makedirs("output", exist_ok=True)
+            profile_path = f"output/{self.output_name}_profile.json"
+            self.profiler.dump(profile_path)
+            print(f"profile summary written to {profile_path}")
+
+    def particle_fields(self):
+        fields = {
+            "x": self.x,
+            "v": self.v,
+            "C": self.C,
+            "F": self.F,
+            "Jp": self.Jp,
+            "p_obj": self.p_obj,
+            "materials": self.materials,
+            "p_is_used": self.p_is_used,
+            "p_id": self.p_id,
+        }
+        if self.cfg.sleep:
+            fields["p_calm"] = self.p_calm
+        return fields
+
+    def set_particle_arrays(self, arrays):
+        # one kernel copies every per-particle array, instead of one
+        # from_numpy kernel per field
+        self.copy_particle_arrays(*[
+            np.ascontiguousarray(arrays[name])
+            for name in ("x", "v", "C", "F", "Jp", "p_obj", "materials",
+                         "p_is_used", "p_id")
+        ])
+        if self.cfg.sleep:
+            self.p_calm.from_numpy(arrays["p_calm"])
+
+    @ti.kernel
+    def copy_particle_arrays(
+        self,
+        x: ti.types.ndarray(),
+        v: ti.types.ndarray(),
+        C: ti.types.ndarray(),
+        F: ti.types.ndarray(),
+        Jp: ti.types.ndarray(),
+        p_obj: ti.types.ndarray(),
+        materials: ti.types.ndarray(),
+        p_is_used: ti.types.ndarray(),
+        p_id: ti.types.ndarray(),
+    ):
+        for p in range(x.shape[0]):
+            for d in ti.static(range(self.dim)):
+                self.x[p][d] = x[p, d]
+                self.v[p][d] = v[p, d]
+                for e in ti.static(range(self.dim)):
+                    self.C[p][d, e] = C[p, d, e]
+                    self.F[p][d, e] = F[p, d, e]
+            self.Jp[p] = Jp[p]
+            self.p_obj[p] = ti.cast(p_obj[p], ti.i16)
+            self.materials[p] = materials[p]
+            self.p_is_used[p] = p_is_used[p]
+            self.p_id[p] = p_id[p]
+
+    def reorder_particles(self, spatial=True):
+        # sort the particles by material and then by the Morton code of their
+        # grid cell, so that neighboring slots touch neighboring grid nodes.
+        # Sorting by material first keeps the material ranges intact. With
+        # emitters and sinks, unused slots are moved to the end of their
+        # material range, which compacts the ranges and empties the free lists
+        n = self.n_particles[None]
+        arrays = {
+            name: field.to_numpy()
+            for name, field in self.particle_fields().items()
+        }
+        if self.dynamic:
+            region = np.searchsorted(self.material_cap_end,
+                                     np.arange(n),
+                                     side="right")
+            unused = arrays["p_is_used"][:n] == 0
+        else:
+            region = arrays["materials"][:n]
+            unused = np.zeros(n, dtype=bool)
+        keys = (region.astype(np.int64) << 31) | (unused.astype(np.int64) << 30)
+        if spatial:
+            cells = np.clip((arrays["x"][:n] * self.inv_dx).astype(np.int64),
+                            0, 2**10 - 1)
+            keys |= morton_code(cells)
+        order = np.argsort(keys, kind="stable")
+        for name, field in self.particle_fields().items():
+            arrays[name][:n] = arrays[name][order]
+            field.from_numpy(arrays[name])
+        if self.dynamic:
+            for m in (WATER, JELLY, SNOW):
+                self.material_end[m] = self.material_start[m] + int(
+                    np.sum((region == m) & ~unused))
+                self.n_free[m] = 0
+            self.update_n_particles()
+
+    def compact_particles(self):
+        self.reorder_particles(spatial=False)
+
+    def particle_bytes(self):
+        # storage of one particle summed over all per-particle fields
+        n_bytes = 0
+        for field in self.particle_fields().values():
+            size = np.dtype(ti.lang.util.to_numpy_type(field.dtype)).itemsize
+            if isinstance(field, ti.MatrixField):
+                size *= field.n * field.m
+            n_bytes += size
+        return n_bytes
+
+    def save_checkpoint(self, path, next_frame, frame_substeps):
+        arrays = {
+            name: field.to_numpy()
+            for name, field in self.particle_fields().items()
+        }
+        arrays["object_ranges"] = np.array(
+            [(obj.start_p_idx, obj.end_p_idx) for obj in self.objects],
+            dtype=np.int64)
+        arrays["material_start"] = self.material_start.to_numpy()
+        arrays["material_end"] = self.material_end.to_numpy()
+        arrays["n_particles"] = np.array(self.n_particles[None])
+        arrays["next_frame"] = np.array(next_frame)
+        arrays["frame_substeps"] = np.array(frame_substeps, dtype=np.int64)
+        arrays["dt_history"] = np.array(self.dt_history, dtype=np.float64)
+        arrays["n_scene_particles"] = np.array(self.n_scene_particles)
+        if self.dynamic:
+            arrays["material_cap_end"] = np.array(self.material_cap_end,
+                                                  dtype=np.int64)
+            arrays["free_slots"] = self.free_slots.to_numpy()
+            arrays["n_free"] = self.n_free.to_numpy()
+            arrays["next_id"] = np.array(self.next_id)
+            arrays["emit_carry"] = np.array(self.emit_carry, dtype=np.float64)
+
+        # write to a temporary file first, so that a crash while saving never
+        # destroys the previous checkpoint
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self, path):
+        with np.load(path) as checkpoint:
+            object_ranges = checkpoint["object_ranges"]
+            if (checkpoint["x"].shape[0] != self.max_n_particles
+                    or object_ranges.shape[0] != len(self.objects)):
+                raise Exception(
+                    f"checkpoint {path} does not match the scene objects")
+            self.set_particle_arrays(checkpoint)
+            for obj, (start, end) in zip(self.objects, object_ranges):
+                obj.start_p_idx, obj.end_p_idx = int(start), int(end)
+            self.material_start.from_numpy(checkpoint["material_start"])
+            self.material_end.from_numpy(checkpoint["material_end"])
+            self.n_particles[None] = int(checkpoint["n_particles"])
+            if self.dynamic:
+                self.material_cap_end = checkpoint["material_cap_end"].tolist()
+                self.free_slots.from_numpy(checkpoint["free_slots"])
+                self.n_free.from_numpy(checkpoint["n_free"])
+                self.next_id = int(checkpoint["next_id"])
+                self.emit_carry = checkpoint["emit_carry"].tolist()
+            if self.cfg.sleep:
+                self.rebuild_grid_sleep()
+            self.dt_history = checkpoint["dt_history"].tolist()
+            return (int(checkpoint["next_frame"]),
+                    checkpoint["frame_substeps"].tolist())
+
+    def store_frame(self, i):
+        frame = f"{i:06}"
+        if self.frame_writer is None:
+            if self.frame_buffer is None:
+                self.frame_buffer = self.make_frame_buffer()
+            self.fetch_frame(self.frame_buffer)
+            self.write_frame_files(frame, self.frame_buffer)
+        else:
+            # only the device to host copy stalls the simulation
+            buffer = self.frame_writer.acquire()
+            self.fetch_frame(buffer)
+            self.frame_writer.submit(
+                lambda buffer: self.write_frame_files(frame, buffer),
+                buffer)
+
+    def make_frame_buffer(self):
+        buffer = {
+            "x": np.empty((self.max_n_particles, self.dim), dtype=np.float32)
+        }
+        if self.run_args.output_format == "binary":
+            if self.run_args.store_velocity:
+                buffer["v"] = np.empty((self.max_n_particles, self.dim),
+                                       dtype=np.float32)
+            if self.run_args.store_material:
+                buffer["materials"] = np.empty(self.max_n_particles,
+                                               dtype=np.int32)
+        if self.dynamic:
+            # slots are copied as they are and grouped by object on the
+            # writer thread
+            for name in ("p_obj", "p_id", "p_is_used"):
+                buffer[name] = np.empty(self.max_n_particles, dtype=np.int32)
+        return buffer
+
+    def fetch_frame(self, buffer):
+        buffer["n"] = self.n_particles[None]
+        buffer["object_ranges"] = [(obj.start_p_idx, obj.end_p_idx)
+                                   for obj in self.objects]
+        self.export_vector_field(self.x, buffer["x"])
+        if "v" in buffer:
+            self.export_vector_field(self.v, buffer["v"])
+        if "materials" in buffer:
+            self.export_scalar_field(self.materials, buffer["materials"])
+        if self.dynamic:
+            self.export_scalar_field(self.p_obj, buffer["p_obj"])
+            self.export_scalar_field(self.p_id, buffer["p_id"])
+            self.export_scalar_field(self.p_is_used, buffer["p_is_used"])
+
+    @ti.kernel
+    def export_vector_field(self, src: ti.template(),
+                            dst: ti.types.ndarray()):
+        for p in range(self.n_particles[None]):
+            q = p
+            if ti.static(not self.dynamic):
+                q = self.p_id[p]
+            for d in ti.static(range(self.dim)):
+                dst[q, d] = src[p][d]
+
+    @ti.kernel
+    def export_scalar_field(self, src: ti.template(),
+                            dst: ti.types.ndarray()):
+        for p in range(self.n_particles[None]):
+            q = p
+            if ti.static(not self.dynamic):
+                q = self.p_id[p]
+            dst[q] = src[p]
+
+    def group_by_object(self, buffer):
+        # the used slots sorted by object and creation order, and the range
+        # of every object in that order
+        n = buffer["n"]
+        used = np.nonzero(buffer["p_is_used"][:n])[0]
+        p_obj = buffer["p_obj"][used]
+        order = used[np.lexsort((buffer["p_id"][used], p_obj))]
+        counts = np.bincount(p_obj, minlength=len(self.objects))
+        ends = np.cumsum(counts)
+        return list(zip(ends - counts, ends)), order
+
+    def write_frame_files(self, frame, buffer):
+        n = buffer["n"]
+        object_ranges = buffer["object_ranges"]
+        order = slice(0, n)
+        if self.dynamic:
+            object_ranges, order = self.group_by_object(buffer)
+        np_x = buffer["x"][order]
+        np_v = buffer["v"][order] if "v" in buffer else None
+        np_materials = (buffer["materials"][order]
+                        if "materials" in buffer else None)
+        if self.ensemble_size == 1:
+            self.write_object_files(f"{self.output_dir}/{frame}",
+                                    object_ranges, np_x, np_v, np_materials)
+            return
+
+        # every member is written like a run of the scene on its own, in
+        # its own coordinates
+        n_objects = len(self.objects) // self.ensemble_size
+        for k in range(self.ensemble_size):
+            ranges = object_ranges[k * n_objects:(k + 1) * n_objects]
+            member = np.concatenate(
+                [np.arange(start, end) for start, end in ranges])
+            counts = np.array([end - start for start, end in ranges])
+            ends = np.cumsum(counts)
+            x = np_x[member]
+            x[:, 0] -= k * self.member_pitch
+            self.write_object_files(
+                f"{self.output_dir}/member_{k:02}/{frame}",
+                list(zip(ends - counts, ends)), x,
+                np_v[member] if np_v is not None else None,
+                np_materials[member] if np_materials is not None else None)
+
+    def write_object_files(self, frame_dir, object_ranges, np_x, np_v,
+                           np_materials):
+        os.makedirs(frame_dir, exist_ok=True)
+        if self.run_args.output_format == "binary":
+            # a single binary file holding every object, see MPM/frame_io.py
+            write_frame(frame_dir + "/" + FRAME_FILE_NAME, object_ranges,
+                        np_x, np_v, np_materials)
+            return
+
+        # output .ply files, 2D particles are written in the z = 0 plane
+        for j, (start, end) in enumerate(object_ranges):
+            writer = ti.tools.PLYWriter(num_vertices=end - start)
+            writer.add_vertex_pos(
+                np_x[start:end, 0],
+                np_x[start:end, 1],
+                np_x[start:end, 2] if self.dim == 3 else np.zeros(end -
+                                                                  start),
+            )
+            writer.export_ascii(frame_dir + f"/particle_object_{j}.ply")
 
     def render(self):
-        if self.run_args.visualize:
+        if self.run_args.visualize and self.dim == 2:
+            self.fill_colors()
+            self.fill_screen_x()
+            self.canvas.set_background_color((0, 0, 0))
+            self.canvas.circles(self.screen_x,
+                                radius=self.particles_radius *
+                                self.screen_scale,
+                                per_vertex_color=self.colors)
+            self.window.show()
+        elif self.run_args.visualize:
             self.camera.track_user_inputs(self.window,
                                           movement_speed=0.03,
                                           hold_key=ti.ui.RMB)
             self.scene.set_camera(self.camera)
 
             self.scene.ambient_light((0, 0, 0))
+            self.fill_colors()
             self.scene.particles(self.x,
                                  per_vertex_color=self.colors,
                                  radius=self.particles_radius)
@@ -438,3 +1649,13 @@ class SimulationRunner:
 
             self.canvas.scene(self.scene)
             self.window.show()
+
+    @ti.kernel
+    def fill_colors(self):
+        for p in range(self.n_particles[None]):
+            self.colors[p] = self.obj_color[self.obj_index(p)]
+
+    @ti.kernel
+    def fill_screen_x(self):
+        for p in range(self.max_n_particles):
+            self.screen_x[p] = self.x[p] * self.screen_scale
@@ -0,0 +1,191 @@
+import argparse
+import ast
+import json
+import multiprocessing as mp
+import platform
+import resource
+import time
+
+import numpy as np
+
+# headless throughput benchmark over the scenarios in MPM/config.
+# every (scenario, quality) case runs in a fresh process on the CPU backend,
+# so compile time and peak memory are measured per case.
+#
+# usage (from the repository root):
+#   python -m benchmarks.mpm_benchmark --qualities 1 2 --substeps 200
+#   python -m benchmarks.mpm_benchmark --scenarios Flood --set sparse_grid=True
+
+
+def make_cfg(base_cfg, quality, overrides):
+    # dt is derived from quality when BaseCfg is defined, so it has to be
+    # recomputed for every benchmarked quality
+    attrs = {"quality": quality, "dt": 2e-4 / quality}
+    attrs.update(overrides)
+    return type(base_cfg.__name__, (base_cfg, ), attrs)
+
+
+def run_case(scenario, quality, n_substeps, overrides, offline_cache, queue):
+    import taichi as ti
+    from MPM.config import scenarios
+
+    cfg = make_cfg(scenarios[scenario], quality, overrides)
+    from MPM.simulation_runner import SimulationRunner, init_taichi
+
+    init_taichi(cfg, arch=ti.cpu, random_seed=0, offline_cache=offline_cache)
+
+    start = time.perf_counter()
+    runner = SimulationRunner(cfg)
+    ti.sync()
+    init_time = time.perf_counter() - start
+
+    # a reordering run starts from spatially sorted particles
+    if cfg.reorder_interval > 0:
+        runner.reorder_particles()
+
+    # the warm-up launch pays for JIT compilation of the fused substep kernel
+    n_warmup = cfg.substeps_per_launch
+    start = time.perf_counter()
+    runner.advance(n_warmup)
+    ti.sync()
+    warmup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    runner.advance(n_substeps)
+    ti.sync()
+    run_time = time.perf_counter() - start
+
+    n_particles = runner.n_particles[None]
+    substeps_per_sec = n_substeps / run_time
+    queue.put({
+        "scenario": scenario,
+        "quality": quality,
+        "overrides": {k: repr(v)
+                      for k, v in overrides.items()},
+        "n_particles": n_particles,
+        "grid_shape": list(runner.grid_shape),
+        "bytes_per_particle": runner.particle_bytes(),
+        "substeps": n_substeps,
+        "init_time": init_time,
+        "compile_time":
+        max(warmup_time - n_warmup * run_time / n_substeps, 0.0),
+        "run_time": run_time,
+        "substeps_per_sec": substeps_per_sec,
+        "particle_updates_per_sec": substeps_per_sec * n_particles,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_memory_mb":
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def run_in_process(target, *args):
+    # runs target(*args, queue) in a fresh process, so that every run
+    # compiles its own kernels and has its own peak memory, and returns what
+    # it put on the queue
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=target, args=args + (queue, ))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise Exception(f"exit code {process.exitcode}")
+    return queue.get()
+
+
+def creation_order_positions(runner):
+    # positions indexed by creation index, independent of any reordering, so
+    # that the objects' [start_p_idx, end_p_idx) ranges select them. Rows
+    # without a live particle (emitter slots, removed particles) are NaN,
+    # emitted particles are left out
+    n = runner.n_particles[None]
+    used = runner.p_is_used.to_numpy()[:n] != 0
+    p_id = runner.p_id.to_numpy()[:n]
+    scene = used & (p_id < runner.max_n_particles)
+    x = np.full((runner.max_n_particles, runner.dim), np.nan)
+    x[p_id[scene]] = runner.x.to_numpy()[:n][scene]
+    return x
+
+
+def parse_overrides(items):
+    overrides = {}
+    for item in items:
+        key, value = item.split("=", 1)
+        overrides[key] = ast.literal_eval(value)
+    return overrides
+
+
+def main(args):
+    from MPM.config import scenarios
+
+    overrides = parse_overrides(args.set)
+    results = []
+    for scenario in args.scenarios:
+        if scenario not in scenarios:
+            raise Exception(f"Undefined scenario {scenario}")
+        for quality in args.qualities:
+            try:
+                result = run_in_process(run_case, scenario, quality,
+                                        args.substeps, overrides,
+                                        args.offline_cache)
+            except Exception as e:
+                print(f"{scenario} quality={quality}: failed")
+                results.append({
+                    "scenario": scenario,
+                    "quality": quality,
+                    "error": str(e),
+                })
+                continue
+            print(f"{scenario} quality={quality}: "
+                  f"{result['substeps_per_sec']:.2f} substeps/s, "
+                  f"{result['particle_updates_per_sec']:.3e} particles/s, "
+                  f"compile {result['compile_time']:.2f}s, "
+                  f"peak {result['peak_memory_mb']:.0f}MB")
+            results.append(result)
+
+    report = {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "arch": "cpu",
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios",
+                        nargs="+",
+                        default=[
+                            "WaterYellySnow", "Flood", "TwoFluid", "TwoBalls",
+                            "DifferentDensity", "PlyExample"
+                        ],
+                        help="scenarios to benchmark")
+    parser.add_argument("--qualities",
+                        type=int,
+                        nargs="+",
+                        default=[1, 2],
+                        help="quality levels to benchmark")
+    parser.add_argument("--substeps",
+                        type=int,
+                        default=200,
+                        help="timed substeps per case")
+    parser.add_argument(
+        "--set",
+        nargs="*",
+        default=[],
+        help="config overrides such as sparse_grid=True",
+    )
+    parser.add_argument(
+        "--offline_cache",
+        action="store_true",
+        default=False,
+        help="Reuse Taichi's offline kernel cache (hides compile time)",
+    )
+    parser.add_argument("--output",
+                        type=str,
+                        default="benchmark_report.json",
+                        help="path of the JSON report")
+    args = parser.parse_args()
+    main(args)
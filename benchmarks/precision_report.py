@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.mpm_benchmark import (make_cfg, parse_overrides,
+                                      run_in_process,
+                                      creation_order_positions)
+
+# error introduced by the storage precision modes of BaseCfg.precision.
+# every mode runs the same scenario in a fresh CPU process, the final
+# particle positions are compared against the default "f32" run.
+#
+# usage (from the repository root):
+#   python -m benchmarks.precision_report --scenario Flood --frames 10
+
+
+def run_mode(scenario, quality, precision, n_frames, overrides, init_path,
+             x_path, queue):
+    import taichi as ti
+    from MPM.config import scenarios
+
+    cfg = make_cfg(scenarios[scenario], quality,
+                   dict(overrides, precision=precision))
+    from MPM.simulation_runner import SimulationRunner, init_taichi
+
+    init_taichi(cfg, arch=ti.cpu, random_seed=0)
+
+    runner = SimulationRunner(cfg)
+    # ti.random draws differ between float types, so every mode starts from
+    # the sampled positions of the reference run
+    if precision == "f32":
+        np.save(init_path, runner.x.to_numpy())
+    else:
+        runner.x.from_numpy(np.load(init_path))
+    # the warm-up launch keeps JIT compilation out of the throughput, it is
+    # part of the compared trajectory in every mode
+    runner.advance(cfg.substeps_per_launch)
+    ti.sync()
+    n_substeps = 0
+    start = time.perf_counter()
+    for _ in range(n_frames):
+        n_substeps += runner.advance_frame()
+    ti.sync()
+    run_time = time.perf_counter() - start
+
+    np.save(x_path, creation_order_positions(runner))
+    queue.put({
+        "precision": precision,
+        "dx": runner.dx,
+        "bytes_per_particle": runner.particle_bytes(),
+        "substeps": n_substeps,
+        "run_time": run_time,
+    })
+
+
+def main(args):
+    overrides = parse_overrides(args.set)
+    runs = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for precision in ["f32"] + args.modes:
+            init_path = os.path.join(tmp_dir, "init.npy")
+            x_path = os.path.join(tmp_dir, f"{precision}.npy")
+            try:
+                runs[precision] = run_in_process(run_mode, args.scenario,
+                                                 args.quality, precision,
+                                                 args.frames, overrides,
+                                                 init_path, x_path)
+            except Exception as e:
+                raise Exception(f"precision {precision} failed") from e
+            runs[precision]["x"] = np.load(x_path)
+
+    reference = runs["f32"]
+    results = []
+    for precision, run in runs.items():
+        error = np.linalg.norm(run["x"] - reference["x"], axis=1)
+        # particles removed in either run have no position
+        error = error[~np.isnan(error)]
+        result = {
+            "precision": precision,
+            "bytes_per_particle": run["bytes_per_particle"],
+            "substeps_per_sec": run["substeps"] / run["run_time"],
+            "max_position_error": float(error.max()),
+            "rms_position_error": float(np.sqrt(np.mean(error**2))),
+            "max_position_error_in_dx": float(error.max() / reference["dx"]),
+        }
+        print(f"{precision}: {result['bytes_per_particle']} bytes/particle, "
+              f"{result['substeps_per_sec']:.2f} substeps/s, "
+              f"max error {result['max_position_error_in_dx']:.3e} dx")
+        results.append(result)
+
+    report = {
+        "scenario": args.scenario,
+        "quality": args.quality,
+        "frames": args.frames,
+        "reference": "f32",
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario",
+                        type=str,
+                        default="Flood",
+                        help="scenario to run in every mode")
+    parser.add_argument("--quality", type=int, default=1, help="quality")
+    parser.add_argument("--frames",
+                        type=int,
+                        default=10,
+                        help="simulated frames per mode")
+    parser.add_argument("--modes",
+                        nargs="+",
+                        default=["f16", "f64"],
+                        choices=["f16", "f64"],
+                        help="modes compared against f32")
+    parser.add_argument(
+        "--set",
+        nargs="*",
+        default=[],
+        help="config overrides such as sparse_grid=True",
+    )
+    parser.add_argument("--output",
+                        type=str,
+                        default="precision_report.json",
+                        help="path of the JSON report")
+    args = parser.parse_args()
+    main(args)
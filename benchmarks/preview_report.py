@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.mpm_benchmark import (make_cfg, parse_overrides,
+                                      run_in_process,
+                                      creation_order_positions)
+
+# speedup and divergence of the preview tier (BaseCfg.preview) against the
+# full quality run of the same scenario. Both tiers run in fresh CPU
+# processes. Particles differ between the tiers, so they are compared per
+# object by centroid distance and by the overlap (IoU) of the grid cells
+# the objects occupy.
+#
+# usage (from the repository root):
+#   python -m benchmarks.preview_report --scenario Flood --frames 10
+
+
+def run_tier(scenario, quality, preview, n_frames, overrides, x_path, queue):
+    import taichi as ti
+    from MPM.config import scenarios
+
+    cfg = make_cfg(scenarios[scenario], quality,
+                   dict(overrides, preview=preview))
+    from MPM.simulation_runner import SimulationRunner, init_taichi
+
+    init_taichi(cfg, arch=ti.cpu, random_seed=0)
+
+    start = time.perf_counter()
+    runner = SimulationRunner(cfg)
+    ti.sync()
+    init_time = time.perf_counter() - start
+
+    # the first frame pays for JIT compilation
+    frame_time = []
+    for _ in range(n_frames):
+        start = time.perf_counter()
+        runner.advance_frame()
+        ti.sync()
+        frame_time.append(time.perf_counter() - start)
+
+    np.save(x_path, creation_order_positions(runner))
+    queue.put({
+        "n_particles": runner.count_alive(),
+        "grid_shape": list(runner.grid_shape),
+        "dx": runner.dx,
+        "substeps_per_frame": runner.cfg.substeps_per_frame,
+        "object_ranges": [(obj.start_p_idx, obj.end_p_idx)
+                          for obj in runner.objects],
+        "init_time": init_time,
+        "frame_time": frame_time,
+    })
+
+
+def occupied_cells(x, dx):
+    return set(map(tuple, np.floor(x / dx).astype(np.int64)))
+
+
+def compare_objects(full, preview):
+    # the preview grid is the coarser one, objects are compared at its
+    # resolution
+    dx = preview["dx"]
+    objects = []
+    for j, ((s0, e0), (s1, e1)) in enumerate(
+            zip(full["object_ranges"], preview["object_ranges"])):
+        x0, x1 = full["x"][s0:e0], preview["x"][s1:e1]
+        x0, x1 = x0[~np.isnan(x0[:, 0])], x1[~np.isnan(x1[:, 0])]
+        if len(x0) == 0 or len(x1) == 0:
+            # emitters and fully drained objects
+            continue
+        cells0, cells1 = occupied_cells(x0, dx), occupied_cells(x1, dx)
+        distance = float(np.linalg.norm(x0.mean(0) - x1.mean(0)))
+        objects.append({
+            "object": j,
+            "centroid_distance": distance,
+            "centroid_distance_in_dx": distance / full["dx"],
+            "occupancy_iou":
+            len(cells0 & cells1) / max(len(cells0 | cells1), 1),
+        })
+    return objects
+
+
+def main(args):
+    overrides = parse_overrides(args.set)
+    runs = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for tier, preview in (("full", False), ("preview", True)):
+            x_path = os.path.join(tmp_dir, f"{tier}.npy")
+            try:
+                runs[tier] = run_in_process(run_tier, args.scenario,
+                                            args.quality, preview,
+                                            args.frames, overrides, x_path)
+            except Exception as e:
+                raise Exception(f"{tier} run failed") from e
+            runs[tier]["x"] = np.load(x_path)
+
+    tiers = {}
+    for tier, run in runs.items():
+        steady = run["frame_time"][1:] or run["frame_time"]
+        tiers[tier] = {
+            "n_particles": run["n_particles"],
+            "grid_shape": run["grid_shape"],
+            "substeps_per_frame": run["substeps_per_frame"],
+            "init_time": run["init_time"],
+            "first_frame_time": run["frame_time"][0],
+            "mean_frame_time": sum(steady) / len(steady),
+            "total_time": run["init_time"] + sum(run["frame_time"]),
+        }
+    full, preview = tiers["full"], tiers["preview"]
+    objects = compare_objects(runs["full"], runs["preview"])
+    report = {
+        "scenario": args.scenario,
+        "quality": args.quality,
+        "frames": args.frames,
+        "tiers": tiers,
+        "frame_speedup": full["mean_frame_time"] / preview["mean_frame_time"],
+        "total_speedup": full["total_time"] / preview["total_time"],
+        "objects": objects,
+        "max_centroid_distance_in_dx":
+        max(o["centroid_distance_in_dx"] for o in objects),
+        "min_occupancy_iou": min(o["occupancy_iou"] for o in objects),
+    }
+    print(f"preview: {report['frame_speedup']:.2f}x faster per frame, "
+          f"{report['total_speedup']:.2f}x including startup")
+    for o in objects:
+        print(f"object {o['object']}: centroid off by "
+              f"{o['centroid_distance_in_dx']:.2f} dx, occupancy IoU "
+              f"{o['occupancy_iou']:.2f}")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario",
+                        type=str,
+                        default="Flood",
+                        help="scenario to run in both tiers")
+    parser.add_argument("--quality", type=int, default=1, help="quality")
+    parser.add_argument("--frames",
+                        type=int,
+                        default=10,
+                        help="simulated frames per tier")
+    parser.add_argument(
+        "--set",
+        nargs="*",
+        default=[],
+        help="config overrides such as sparse_grid=True",
+    )
+    parser.add_argument("--output",
+                        type=str,
+                        default="preview_report.json",
+                        help="path of the JSON report")
+    args = parser.parse_args()
+    main(args)
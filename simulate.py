@@ -1,29 +1,31 @@
+import time
+
+# startup is timed from the first import on, see --profile
+start_time = time.perf_counter()
+
 import taichi as ti
 import argparse
-from MPM.simulation_runner import SimulationRunner
-from MPM.config import WaterYellySnowCfg, DifferentDensityCfg, FloodCfg, TwoFluidCfg, TwoBallCfg, PlyExampleCfg
-
-# you may want to change the arch to ti.vulkan manually if you are using Apple M1/M2
-ti.init(arch=ti.gpu)
+from MPM.simulation_runner import SimulationRunner, init_taichi
+from MPM.config import scenarios
+from MPM.profiler import StartupTimer
 
 
 def main(args):
-    if args.scenario == "WaterYellySnow":
-        cfg = WaterYellySnowCfg
-    elif args.scenario == "DifferentDensity":
-        cfg = DifferentDensityCfg
-    elif args.scenario == "Flood":
-        cfg = FloodCfg
-    elif args.scenario == "TwoFluid":
-        cfg = TwoFluidCfg
-    elif args.scenario == "TwoBalls":
-        cfg = TwoBallCfg
-    elif args.scenario == "PlyExample":
-        cfg = PlyExampleCfg
-    else:
+    startup = StartupTimer(start_time)
+    startup.lap("imports", sync=False)
+    if args.scenario not in scenarios:
         raise Exception("Undefined scenario")
+    cfg = scenarios[args.scenario]
+    if args.preview:
+        cfg = type(cfg.__name__, (cfg, ), {"preview": True})
+    if args.init_cache:
+        cfg = type(cfg.__name__, (cfg, ), {"init_cache": True})
 
-    runner = SimulationRunner(cfg)
+    # you may want to change the arch to ti.vulkan manually if you are using Apple M1/M2
+    init_taichi(cfg, arch=ti.gpu)
+    startup.lap("ti_init")
+
+    runner = SimulationRunner(cfg, startup)
     runner.run(args)
 
 
@@ -33,6 +35,20 @@ if __name__ == "__main__":
                         type=str,
                         default="WaterYellySnow",
                         help="scenario")
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        default=False,
+        help="Run the cheap preview tier of the scenario (see "
+        "BaseCfg.preview), output goes to output/<scenario>_preview",
+    )
+    parser.add_argument(
+        "--init_cache",
+        action="store_true",
+        default=False,
+        help="Cache the initial particle state in the cache_dir of the "
+        "config and load it on later runs (see BaseCfg.init_cache)",
+    )
     parser.add_argument(
         "--visualize",
         action="store_true",
@@ -45,6 +61,53 @@ if __name__ == "__main__":
         default=False,
         help="Store the output .ply files",
     )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="ply",
+        choices=["ply", "binary"],
+        help="ascii .ply files per object, or one binary frame file "
+        "(convert with MPM/frames_to_ply.py)",
+    )
+    parser.add_argument(
+        "--store_velocity",
+        action="store_true",
+        default=False,
+        help="Also store particle velocities in binary frames",
+    )
+    parser.add_argument(
+        "--store_material",
+        action="store_true",
+        default=False,
+        help="Also store particle materials in binary frames",
+    )
+    parser.add_argument(
+        "--output_queue_size",
+        type=int,
+        default=2,
+        help="Frames buffered for the background writer, 0 writes "
+        "synchronously",
+    )
+    parser.add_argument(
+        "--checkpoint_interval",
+        type=int,
+        default=0,
+        help="Save output/<scenario>_checkpoint.npz every N frames, 0 "
+        "disables checkpoints",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue from output/<scenario>_checkpoint.npz",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="Time every substep phase and write a profile summary, and "
+        "print how long the startup stages took",
+    )
     parser.add_argument("--simulation_steps",
                         type=int,
                         default=200,
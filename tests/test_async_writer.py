@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from MPM.async_writer import AsyncFrameWriter
+
+
+def slow_write(written, frame):
+
+    def write(buffer):
+        time.sleep(0.01)
+        written.append((frame, buffer["frame"]))
+
+    return write
+
+
+def submit_frames(writer, written, n_frames):
+    for frame in range(n_frames):
+        buffer = writer.acquire()
+        buffer["frame"] = frame
+        writer.submit(slow_write(written, frame), buffer)
+
+
+def test_close_writes_every_frame():
+    written = []
+    writer = AsyncFrameWriter(dict, n_buffers=2)
+    submit_frames(writer, written, 5)
+    writer.close()
+    assert written == [(frame, frame) for frame in range(5)]
+
+
+def test_flush_waits_for_pending_frames():
+    written = []
+    writer = AsyncFrameWriter(dict, n_buffers=3)
+    submit_frames(writer, written, 3)
+    writer.flush()
+    assert len(written) == 3
+    # every buffer is free again
+    assert writer.free_buffers.qsize() == 3
+    writer.close()
+
+
+def fail(buffer):
+    raise OSError("disk full")
+
+
+def test_acquire_raises_writer_error():
+    writer = AsyncFrameWriter(dict, n_buffers=1)
+    writer.submit(fail, writer.acquire())
+    # the error is recorded before the buffer is released
+    writer.acquire()
+    with pytest.raises(Exception, match="frame writer failed") as e:
+        writer.acquire()
+    assert isinstance(e.value.__cause__, OSError)
+    with pytest.raises(Exception, match="frame writer failed"):
+        writer.close()
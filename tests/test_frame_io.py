@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+
+from MPM.frame_io import (FRAME_FILE_NAME, HEADER_DTYPE, MAGIC,
+                          object_positions, read_frame, write_frame)
+
+
+def random_frame(n_particles, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.random((n_particles, dim), dtype=np.float32)
+    v = rng.standard_normal((n_particles, dim)).astype(np.float32)
+    materials = rng.integers(0, 3, n_particles).astype(np.int32)
+    split = n_particles // 3
+    return [(0, split), (split, n_particles)], x, v, materials
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+@pytest.mark.parametrize("n_particles", [6, 7])
+@pytest.mark.parametrize("store_velocity", [False, True])
+@pytest.mark.parametrize("store_material", [False, True])
+def test_round_trip(tmp_path, dim, n_particles, store_velocity,
+                    store_material):
+    object_ranges, x, v, materials = random_frame(n_particles, dim)
+    path = os.path.join(tmp_path, FRAME_FILE_NAME)
+    write_frame(path, object_ranges, x, v if store_velocity else None,
+                materials if store_material else None)
+
+    frame = read_frame(path)
+    np.testing.assert_array_equal(frame["object_ranges"], object_ranges)
+    np.testing.assert_array_equal(frame["x"], x)
+    assert ("v" in frame) == store_velocity
+    assert ("materials" in frame) == store_material
+    if store_velocity:
+        np.testing.assert_array_equal(frame["v"], v)
+    if store_material:
+        np.testing.assert_array_equal(frame["materials"], materials)
+    for j, (start, end) in enumerate(object_ranges):
+        np.testing.assert_array_equal(object_positions(frame, j),
+                                      x[start:end])
+
+    # every section starts at a multiple of 8 bytes
+    assert os.path.getsize(path) % 8 == 0
+    for section in frame.values():
+        assert section.offset % 8 == 0
+
+
+def test_read_version_1(tmp_path):
+    # version 1 frames have no padding between the sections
+    object_ranges, x, v, materials = random_frame(7, 3)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = 1
+    header["flags"] = 3
+    header["dim"] = 3
+    header["n_objects"] = len(object_ranges)
+    header["n_particles"] = x.shape[0]
+    path = os.path.join(tmp_path, FRAME_FILE_NAME)
+    with open(path, "wb") as f:
+        header.tofile(f)
+        np.asarray(object_ranges, dtype="<i8").tofile(f)
+        x.tofile(f)
+        v.tofile(f)
+        materials.tofile(f)
+        np.zeros(1, dtype="<i4").tofile(f)
+
+    frame = read_frame(path)
+    np.testing.assert_array_equal(frame["x"], x)
+    np.testing.assert_array_equal(frame["v"], v)
+    np.testing.assert_array_equal(frame["materials"], materials)
+
+
+def test_not_a_frame(tmp_path):
+    path = os.path.join(tmp_path, FRAME_FILE_NAME)
+    with open(path, "wb") as f:
+        f.write(bytes(HEADER_DTYPE.itemsize))
+    with pytest.raises(Exception, match="not an MPM frame file"):
+        read_frame(path)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import trimesh
+
+from MPM.mesh_sampler import fill_mesh
+
+
+def filled_volume(mesh, spacing):
+    points = fill_mesh(mesh.vertices[mesh.faces], spacing,
+                       np.random.default_rng(0))
+    return points.shape[0] * spacing**3
+
+
+@pytest.mark.parametrize("spacing", [0.1, 0.125, 0.05])
+def test_fill_box(spacing):
+    # the faces of an axis-aligned box lie on the columns' cell boundaries
+    box = trimesh.creation.box([1, 1, 1])
+    assert filled_volume(box, spacing) == pytest.approx(1.0, rel=1e-6)
+
+
+@pytest.mark.parametrize("spacing", [0.05, 0.04])
+def test_fill_sphere(spacing):
+    sphere = trimesh.creation.icosphere(subdivisions=5, radius=1.0)
+    assert filled_volume(sphere, spacing) == pytest.approx(sphere.volume,
+                                                           rel=0.02)
+
+
+def test_points_inside_box():
+    box = trimesh.creation.box([1, 2, 3])
+    points = fill_mesh(box.vertices[box.faces], 0.1, np.random.default_rng(0))
+    assert np.all(np.abs(points) <= np.array([0.5, 1.0, 1.5]) + 1e-6)